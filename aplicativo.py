@@ -1,52 +1,213 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from streamlit_option_menu import option_menu
 import psycopg2
 from psycopg2 import OperationalError
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from datetime import datetime, date, timedelta
 import pandas as pd
-from PIL import Image
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import requests
-from io import BytesIO
+from requests.adapters import HTTPAdapter
 from fpdf import FPDF
+import io
 import os
+import re
 import uuid
+import hashlib
+import hmac
+import time
+import threading
 import calendar
-import altair as alt
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from sklearn.linear_model import LinearRegression
-import mitosheet  # For MitoSheet
-from mitosheet.streamlit.v1 import spreadsheet
-from mitosheet.streamlit.v1.spreadsheet import _get_mito_backend
 
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+###############################################################################
+#                               CONSTANTES
+###############################################################################
+TRANSACTION_TYPES = ["Entrada", "Saída"]
+TRANSACTION_INDEX = {t: i for i, t in enumerate(TRANSACTION_TYPES)}
+
+ORDER_STATUS_OPTIONS = [
+    "em aberto", "Received - Debited", "Received - Credit",
+    "Received - Pix", "Received - Cash"
+]
+ORDER_STATUS_INDEX = {s: i for i, s in enumerate(ORDER_STATUS_OPTIONS)}
+
+# Célula de dia gerada por calendar.HTMLCalendar, ex.: <td class="mon">5</td>
+CALENDAR_DAY_CELL = re.compile(r'<td class="(mon|tue|wed|thu|fri|sat|sun)">(\d+)</td>')
+
+# Linhas por página nas listagens longas (paginate_df)
+PAGE_SIZE = 200
+
+# Meses do calendário de eventos (1..12) e seus nomes, para a selectbox de mês
+MONTHS = list(range(1, 13))
+MONTH_NAMES = {m: calendar.month_name[m] for m in MONTHS}
+
+# Quantos eventos (os mais recentes) aparecem na lista de edição do calendário de eventos
+EVENTS_EDIT_LIMIT = 100
+
+# Circuit breaker do banco: após DB_FAILURE_THRESHOLD falhas de conexão em
+# DB_FAILURE_WINDOW segundos, novas tentativas ficam suspensas por DB_COOLDOWN segundos
+DB_FAILURE_THRESHOLD = 3
+DB_FAILURE_WINDOW = 30
+DB_COOLDOWN = 60
+
+# Tamanho máximo do pool (compartilhado por todas as sessões). Cada sessão usa uma conexão
+# por vez, ou DB_PARALLEL_QUERIES durante load_all_data: 20 cobre ~10 sessões carregando
+# ao mesmo tempo, e acima disso os pedidos esperam uma vaga em vez de falhar
+DB_POOL_MAX = 20
+# Quanto tempo (s) um pedido de conexão espera por uma vaga antes de desistir
+DB_CHECKOUT_TIMEOUT = 10
+
+# Conexões que run_many usa ao mesmo tempo; bem abaixo de DB_POOL_MAX
+DB_PARALLEL_QUERIES = 2
+
+# Reenvio do mesmo formulário com os mesmos valores dentro deste intervalo (s) é tratado como clique duplo
+SUBMIT_DEDUP_SECONDS = 3
+
+# Cupons de desconto aceitos no caixa: código -> fração de desconto ("10" -> 10%, ..., "100" -> 100%)
+VALID_COUPONS = {str(pct): pct / 100 for pct in range(10, 101, 5)}
+
+# Páginas do menu lateral (option_menu) e os ícones Bootstrap correspondentes, na mesma ordem
+MENU_PAGES = (
+    "Home", "Orders", "Products", "Stock", "Clients",
+    "Cash", "Analytics", "Calendário de Eventos",
+    "Settings", "Loyalty Program"
+)
+MENU_ICONS = (
+    "house", "file-text", "box", "list-task", "layers",
+    "receipt", "bar-chart", "calendar", "gear", "star"
+)
+
+# Linha de item da nota fiscal: descrição (20), quantidade (5) e total formatado
+INVOICE_LINE_TEMPLATE = "{descricao:<20} {qtd:>5} {total}"
+
+# Usuário/hash do login são completados até este tamanho (bytes) antes da comparação
+CREDENTIAL_PAD_LENGTH = 64
+
+# Toda tentativa de login leva pelo menos este tempo (s), acertando ou não a senha
+LOGIN_MIN_SECONDS = 0.25
+
+# Após LOGIN_MAX_ATTEMPTS falhas do mesmo IP em LOGIN_ATTEMPT_WINDOW segundos, o login é recusado
+LOGIN_MAX_ATTEMPTS = 5
+LOGIN_ATTEMPT_WINDOW = 60
+
 ###############################################################################
 #                               UTILIDADES
 ############################################################################### 
+# st.rerun (Streamlit 1.27+) quando existir; senão o antigo st.experimental_rerun
+rerun = getattr(st, "rerun", None) or st.experimental_rerun
+
+# Troca separadores en-US ("1,234.56") pelos brasileiros ("1.234,56") em uma única passada
+_BRL_SEPARATORS = str.maketrans({",": ".", ".": ","})
+
+@lru_cache(maxsize=4096)
 def format_currency(value: float) -> str:
     """Formata um valor float para o formato de moeda brasileira."""
-    return f"R$ {value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    return f"R$ {value:,.2f}".translate(_BRL_SEPARATORS)
+
+# Insere "." como separador de milhar na parte inteira ("1234567" -> "1.234.567")
+_THOUSANDS_PATTERN = r"\B(?=(\d{3})+(?!\d))"
+
+def format_currency_series(s: pd.Series) -> pd.Series:
+    """
+    Versão vetorizada de format_currency para uma coluna inteira.
+    Trabalha em centavos inteiros, sem chamar format_currency linha a linha.
+    """
+    cents = (pd.to_numeric(s, errors="coerce").fillna(0) * 100).round().astype("int64")
+    sinal = cents.lt(0).map({True: "-", False: ""})
+    inteiro = (cents.abs() // 100).astype(str).str.replace(_THOUSANDS_PATTERN, ".", regex=True)
+    centavos = (cents.abs() % 100).astype(str).str.zfill(2)
+    return "R$ " + sinal + inteiro + "," + centavos
 
 def download_df_as_csv(df: pd.DataFrame, filename: str, label: str = "Baixar CSV"):
-    """Disponibiliza um DataFrame como CSV para download."""
-    csv_data = df.to_csv(index=False)
-    st.download_button(label=label, data=csv_data, file_name=filename, mime="text/csv")
+    """
+    Disponibiliza um DataFrame como CSV para download.
+    O CSV só é gerado quando o usuário clica em "Gerar", e não a cada rerun da página.
+    """
+    if st.button(f"Gerar {filename}", key=f"prepare_{filename}"):
+        try:
+            # Escrita em C++ pelo pyarrow; bem mais rápida que df.to_csv em tabelas grandes
+            buffer = io.BytesIO()
+            pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buffer)
+            csv_data = buffer.getvalue()
+        except pa.ArrowException:
+            # Tipos que o Arrow não converte (ex.: colunas object mistas) seguem pelo pandas
+            csv_data = df.to_csv(index=False)
+        st.download_button(label=label, data=csv_data, file_name=filename, mime="text/csv")
+
+def download_query_as_csv(query: str, filename: str, label: str = "Baixar CSV"):
+    """
+    Disponibiliza o resultado de uma query como CSV gerado pelo próprio PostgreSQL
+    (COPY ... TO STDOUT), sem passar por pandas. Também só gera ao clicar em "Gerar".
+    """
+    if st.button(f"Gerar {filename}", key=f"prepare_{filename}"):
+        csv_data = copy_query_to_csv(query)
+        if csv_data is not None:
+            st.download_button(label=label, data=csv_data, file_name=filename, mime="text/csv")
+
+def download_query_as_parquet(query: str, columns: list, filename: str, label: str = "Baixar Parquet"):
+    """
+    Disponibiliza o resultado de uma query como Parquet gravado em lotes direto do
+    cursor do banco (copy_query_to_parquet). Também só gera ao clicar em "Gerar".
+    """
+    if st.button(f"Gerar {filename}", key=f"prepare_{filename}"):
+        parquet_data = copy_query_to_parquet(query, columns)
+        if parquet_data is not None:
+            st.download_button(label=label, data=parquet_data, file_name=filename, mime="application/octet-stream")
 
 def download_df_as_json(df: pd.DataFrame, filename: str, label: str = "Baixar JSON"):
     """Disponibiliza um DataFrame como JSON para download."""
     json_data = df.to_json(orient='records', lines=False)
     st.download_button(label=label, data=json_data, file_name=filename, mime="application/json")
 
-def download_df_as_html(df: pd.DataFrame, filename: str, label: str = "Baixar HTML"):
-    """Disponibiliza um DataFrame como HTML para download."""
-    html_data = df.to_html(index=False)
-    st.download_button(label=label, data=html_data, file_name=filename, mime="text/html")
+def first_submit(form_key: str, *values) -> bool:
+    """
+    Retorna False (e avisa) se o formulário `form_key` foi gravado com os mesmos
+    `values` há menos de SUBMIT_DEDUP_SECONDS (ver record_submit), para um clique
+    duplo não gravar o mesmo registro duas vezes.
+    """
+    last = st.session_state.get("_last_submit")
+    if last and last[0] == (form_key, repr(values)) and time.monotonic() - last[1] < SUBMIT_DEDUP_SECONDS:
+        st.warning("Envio repetido ignorado.")
+        return False
+    return True
+
+def record_submit(form_key: str, *values):
+    """
+    Registra o envio de `form_key` com `values` para first_submit. Chamada só depois
+    da gravação bem-sucedida: uma nova tentativa após falha não é descartada.
+    """
+    st.session_state["_last_submit"] = ((form_key, repr(values)), time.monotonic())
+
+def paginate_df(df, key: str, page_size: int = PAGE_SIZE):
+    """
+    Retorna só a página escolhida de `df` (seletor "Página" com chave `key`),
+    para não enviar todas as linhas ao navegador a cada rerun.
+    Aceita DataFrame ou lista.
+    """
+    total_pages = max(1, -(-len(df) // page_size))
+    if total_pages == 1:
+        return df
+    page = st.number_input(
+        f"Página (de {total_pages})", min_value=1, max_value=total_pages, value=1, step=1, key=key
+    )
+    start = (int(page) - 1) * page_size
+    if isinstance(df, pd.DataFrame):
+        return df.iloc[start:start + page_size]
+    return df[start:start + page_size]
 
 def download_df_as_parquet(df: pd.DataFrame, filename: str, label: str = "Baixar Parquet"):
     """Disponibiliza um DataFrame como Parquet para download."""
-    import io
     buffer = io.BytesIO()
     df.to_parquet(buffer, index=False)
     buffer.seek(0)
@@ -57,6 +218,31 @@ def download_df_as_parquet(df: pd.DataFrame, filename: str, label: str = "Baixar
         mime="application/octet-stream"
     )
 
+@lru_cache(maxsize=32)
+def month_html(year: int, month: int) -> str:
+    """HTML do mês gerado por calendar.HTMLCalendar; só depende de (ano, mês)."""
+    return calendar.HTMLCalendar(firstweekday=0).formatmonth(year, month)
+
+@st.cache_data(show_spinner=False)
+def render_events_calendar(year: int, month: int, event_counts: tuple) -> str:
+    """
+    Gera o HTML do calendário do mês marcando os dias com eventos.
+    `event_counts` é uma tupla ordenada de (dia, quantidade de eventos).
+    """
+    counts = dict(event_counts)
+
+    def marcar_dia(match):
+        # <td class="mon">5</td> -> <td class="mon event-day" title="X evento(s)">5<br/><span>X</span></td>
+        dia = int(match.group(2))
+        count = counts.get(dia)
+        if count is None:
+            return match.group(0)
+        return f'<td class="{match.group(1)} event-day" title="{count} evento(s)">{dia}<br/><span>{count}</span></td>'
+
+    html_calendario = month_html(year, month)
+    # Uma única passada sobre o HTML para marcar todos os dias com eventos
+    return CALENDAR_DAY_CELL.sub(marcar_dia, html_calendario)
+
 ###############################################################################
 #                      FUNÇÕES PARA PDF E UPLOAD (OPCIONAIS)
 ###############################################################################
@@ -77,115 +263,637 @@ def convert_df_to_pdf(df: pd.DataFrame) -> bytes:
             pdf.cell(60, 10, str(item), border=1)
         pdf.ln()
 
-    return pdf.output(dest='S').encode('latin1')
+    # fpdf2 devolve bytearray (o antigo .encode('latin1') era da PyFPDF)
+    return bytes(pdf.output())
 
-def upload_pdf_to_fileio(pdf_bytes: bytes) -> str:
+@st.cache_resource(show_spinner=False)
+def get_http_session() -> requests.Session:
     """
-    Faz upload de um PDF (conteúdo em bytes) para file.io e retorna o link de download.
+    Sessão HTTP compartilhada (por processo), que mantém as conexões TCP/TLS abertas
+    entre chamadas em vez de refazer o handshake a cada requisição.
     """
-    try:
-        response = requests.post(
-            'https://file.io/',
-            files={'file': ('stock_vs_orders_summary.pdf', pdf_bytes, 'application/pdf')}
-        )
-        if response.status_code == 200:
-            json_resp = response.json()
-            if json_resp.get('success'):
-                return json_resp.get('link', "")
-            else:
-                return ""
-        else:
-            return ""
-    except:
-        return ""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    return session
 
 ###############################################################################
 #                            CONEXÃO COM BANCO
 ###############################################################################
-def get_db_connection():
+# SQL -> nome do prepared statement (preenchido a partir de DATA_QUERIES e das demais consultas frequentes)
+PREPARED_STATEMENTS = {}
+
+# Placeholder do psycopg2 ("%s"), trocado por $1, $2, ... no PREPARE
+_PLACEHOLDER = re.compile(r"%s")
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Conexão do pool que guarda os prepared statements já criados nela."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+@st.cache_resource(show_spinner=False)
+def get_pool():
     """
-    Retorna uma conexão com o banco PostgreSQL usando st.secrets["db"].
+    Cria uma única vez (por processo) o pool de conexões com o PostgreSQL usando st.secrets["db"].
     Exige que existam host, name, user, password, port em st.secrets["db"].
     """
+    return ThreadedConnectionPool(
+        1, DB_POOL_MAX,
+        host=st.secrets["db"]["host"],
+        database=st.secrets["db"]["name"],
+        user=st.secrets["db"]["user"],
+        password=st.secrets["db"]["password"],
+        port=st.secrets["db"]["port"],
+        connection_factory=PreparingConnection
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_pool_slots() -> threading.BoundedSemaphore:
+    """
+    Uma vaga por conexão do pool. O ThreadedConnectionPool levanta PoolError assim
+    que esgota, então quem pede conexão espera uma vaga aqui antes do getconn.
+    """
+    return threading.BoundedSemaphore(DB_POOL_MAX)
+
+def checkout_connection(pool, slots):
+    """
+    Espera até DB_CHECKOUT_TIMEOUT segundos por uma vaga em `slots` e retorna uma
+    conexão de `pool`. Não chama o Streamlit: levanta PoolError se o tempo acabar e
+    repassa os erros de conexão. Devolver com checkin_connection().
+    """
+    if not slots.acquire(timeout=DB_CHECKOUT_TIMEOUT):
+        raise PoolError("nenhuma conexão livre no pool")
     try:
-        conn = psycopg2.connect(
-            host=st.secrets["db"]["host"],
-            database=st.secrets["db"]["name"],
-            user=st.secrets["db"]["user"],
-            password=st.secrets["db"]["password"],
-            port=st.secrets["db"]["port"]
-        )
-        return conn
-    except Exception as e:
+        return pool.getconn()
+    except BaseException:
+        slots.release()
+        raise
+
+def checkin_connection(pool, slots, conn):
+    """
+    Devolve `conn` ao pool (o pool faz rollback de transações pendentes) e libera a vaga.
+    Conexões fechadas ou quebradas são descartadas em vez de reaproveitadas.
+    """
+    try:
+        pool.putconn(conn, close=bool(conn.closed))
+    except Exception:
+        if not conn.closed:
+            conn.close()
+    finally:
+        slots.release()
+
+def record_db_failure(error: Exception):
+    """Registra uma falha de conexão em st.session_state._db_errors (instante, erro)."""
+    now = time.monotonic()
+    failures = st.session_state.setdefault("_db_errors", [])
+    failures[:] = [(t, e) for t, e in failures if now - t < DB_FAILURE_WINDOW]
+    failures.append((now, error))
+
+def db_circuit_open() -> bool:
+    """
+    True se houve DB_FAILURE_THRESHOLD falhas recentes e o cool-down ainda não passou:
+    nesse caso o aplicativo nem tenta o banco, em vez de repetir as queries a cada rerun.
+    """
+    failures = st.session_state.get("_db_errors", [])
+    if len(failures) < DB_FAILURE_THRESHOLD:
+        return False
+    return time.monotonic() - failures[-1][0] < DB_COOLDOWN
+
+def get_db_connection():
+    """
+    Retorna uma conexão do pool. Deve ser devolvida com release_db_connection().
+    Retorna None se a conexão falhar ou se o circuit breaker estiver aberto.
+    """
+    if db_circuit_open():
+        st.error("Banco de dados indisponível no momento. Tente novamente em instantes.")
+        return None
+    try:
+        return checkout_connection(get_pool(), get_pool_slots())
+    except PoolError:
+        # Nenhuma vaga em DB_CHECKOUT_TIMEOUT s é concorrência, não banco fora do ar:
+        # não conta para o circuit breaker
+        st.error("Banco de dados ocupado no momento. Tente novamente em instantes.")
+        return None
+    except (psycopg2.Error, KeyError) as e:
+        record_db_failure(e)
         st.error(f"Falha na conexão com o banco de dados: {e}")
         return None
 
-def run_query(query: str, values=None, commit: bool = False):
+def release_db_connection(conn):
+    """Devolve ao pool uma conexão obtida com get_db_connection() (ver checkin_connection)."""
+    if conn is None:
+        return
+    checkin_connection(get_pool(), get_pool_slots(), conn)
+
+def discard_if_broken(conn, error: Exception):
+    """
+    Fecha a conexão se o erro indicar que ela caiu, para o pool não reutilizá-la,
+    e conta a falha para o circuit breaker.
+    """
+    if isinstance(error, (OperationalError, psycopg2.InterfaceError)):
+        record_db_failure(error)
+        if not conn.closed:
+            conn.close()
+
+def execute(cursor, query: str, values=None):
+    """
+    Executa `query` no cursor. Queries registradas em PREPARED_STATEMENTS são
+    preparadas (PREPARE) na primeira vez em cada conexão e depois só executadas
+    (EXECUTE), poupando o parse/plan a cada chamada.
+    """
+    name = PREPARED_STATEMENTS.get(query)
+    prepared = getattr(cursor.connection, "prepared", None)
+    if name is None or prepared is None:
+        cursor.execute(query, values or ())
+        return
+    if name not in prepared:
+        # "%s" viram parâmetros posicionais do servidor ($1, $2, ...)
+        counter = iter(range(1, query.count("%s") + 1))
+        cursor.execute(f"PREPARE {name} AS {_PLACEHOLDER.sub(lambda _: f'${next(counter)}', query)}")
+        prepared.add(name)
+    if values:
+        cursor.execute(f"EXECUTE {name}({', '.join(['%s'] * len(values))})", values)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+def run_query(query: str, values=None, commit: bool = False, one: bool = False):
     """
     Executa uma query SQL no banco. Se commit=True, salva a transação.
     Retorna o resultado se commit=False, ou True/False se commit=True.
+    Com one=True retorna só a primeira linha (fetchone; None se vazio), sem montar a lista.
     """
     conn = get_db_connection()
     if not conn:
         return None
     try:
         with conn.cursor() as cursor:
-            cursor.execute(query, values or ())
+            execute(cursor, query, values)
             if commit:
                 conn.commit()
                 return True
+            elif one:
+                return cursor.fetchone()
             else:
                 return cursor.fetchall()
     except Exception as e:
+        discard_if_broken(conn, e)
         st.error(f"Erro ao executar query: {e}")
         return None
     finally:
-        if conn and not conn.closed:
-            conn.close()
+        release_db_connection(conn)
+
+def run_in_transaction(statements: list):
+    """
+    Executa uma lista de (query, values) na mesma conexão e transação, com um único commit.
+    Retorna a lista de resultados (fetchall das queries que retornam linhas, None nas demais)
+    ou None se alguma falhar (nesse caso nada é gravado).
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        results = []
+        with conn:
+            with conn.cursor() as cursor:
+                for query, values in statements:
+                    execute(cursor, query, values)
+                    results.append(cursor.fetchall() if cursor.description else None)
+        return results
+    except Exception as e:
+        discard_if_broken(conn, e)
+        st.error(f"Erro ao executar transação: {e}")
+        return None
+    finally:
+        release_db_connection(conn)
+
+def run_many(queries: dict) -> dict:
+    """
+    Executa várias queries de leitura ({chave: SQL}) em paralelo, no máximo
+    DB_PARALLEL_QUERIES de cada vez (uma conexão do pool por query em andamento),
+    e retorna {chave: linhas}. Retorna {} se alguma falhar.
+    """
+    if not queries:
+        return {}
+    if db_circuit_open():
+        st.error("Banco de dados indisponível no momento. Tente novamente em instantes.")
+        return {}
+    try:
+        pool, slots = get_pool(), get_pool_slots()
+    except (psycopg2.Error, KeyError) as e:
+        record_db_failure(e)
+        st.error(f"Falha na conexão com o banco de dados: {e}")
+        return {}
+
+    def fetch(query):
+        # Roda nas threads auxiliares: nada de st.*; os erros são repassados a run_many
+        conn = checkout_connection(pool, slots)
+        try:
+            with conn.cursor() as cursor:
+                execute(cursor, query)
+                return cursor.fetchall()
+        except (OperationalError, psycopg2.InterfaceError):
+            # Conexão caída: fechada aqui, checkin_connection a descarta do pool
+            if not conn.closed:
+                conn.close()
+            raise
+        finally:
+            checkin_connection(pool, slots, conn)
+
+    with ThreadPoolExecutor(max_workers=min(len(queries), DB_PARALLEL_QUERIES)) as executor:
+        futures = [executor.submit(fetch, query) for query in queries.values()]
+    errors = [f.exception() for f in futures if f.exception() is not None]
+    if not errors:
+        return dict(zip(queries, (f.result() for f in futures)))
+
+    # Erros relatados uma única vez, na thread do script
+    if all(isinstance(e, PoolError) for e in errors):
+        st.error("Banco de dados ocupado no momento. Tente novamente em instantes.")
+        return {}
+    error = next(e for e in errors if not isinstance(e, PoolError))
+    if isinstance(error, (OperationalError, psycopg2.InterfaceError)):
+        record_db_failure(error)
+    st.error(f"Erro ao executar query: {error}")
+    return {}
+
+def run_query_stream(query: str, values=None, batch_size: int = 2000):
+    """
+    Executa um SELECT com cursor nomeado (server-side) e gera as linhas em lotes
+    (listas de até `batch_size` tuplas), sem montar o resultado inteiro em memória.
+    A conexão fica com o gerador até ele terminar ou ser fechado.
+    Sem conexão levanta RuntimeError, e erros do banco são repassados: quem consome
+    decide o valor de falha (ex.: copy_query_to_parquet retorna None).
+    """
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("sem conexão com o banco de dados")
+    try:
+        with conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(query, values or ())
+            yield from iter(lambda: cursor.fetchmany(batch_size), [])
+    except Exception as e:
+        discard_if_broken(conn, e)
+        raise
+    finally:
+        release_db_connection(conn)
+
+def copy_query_to_csv(query: str):
+    """
+    Executa `COPY (query) TO STDOUT WITH CSV HEADER` e retorna o CSV em bytes.
+    Retorna None em caso de erro.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        buffer = io.BytesIO()
+        with conn.cursor() as cursor:
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH CSV HEADER", buffer)
+        return buffer.getvalue()
+    except Exception as e:
+        discard_if_broken(conn, e)
+        st.error(f"Erro ao exportar CSV: {e}")
+        return None
+    finally:
+        release_db_connection(conn)
+
+def copy_query_to_parquet(query: str, columns: list, batch_size: int = 10000):
+    """
+    Lê `query` em lotes de `batch_size` linhas (run_query_stream) e grava o resultado
+    em Parquet, um row group por lote, sem montar a lista inteira nem um DataFrame.
+    Retorna o arquivo em bytes, ou None em caso de erro.
+    """
+    writer = None
+    try:
+        buffer = io.BytesIO()
+        for batch in run_query_stream(query, batch_size=batch_size):
+            table = pa.Table.from_arrays([pa.array(col) for col in zip(*batch)], names=columns)
+            if writer is None:
+                writer = pq.ParquetWriter(buffer, table.schema)
+            writer.write_table(table.cast(writer.schema))
+        if writer is None:
+            # Sem linhas: arquivo só com o cabeçalho das colunas
+            writer = pq.ParquetWriter(buffer, pa.schema([(name, pa.null()) for name in columns]))
+        writer.close()
+        return buffer.getvalue()
+    except Exception as e:
+        st.error(f"Erro ao exportar Parquet: {e}")
+        return None
 
 ###############################################################################
 #                         CARREGAMENTO DE DADOS (CACHE)
 ###############################################################################
+def rows_to_table(rows, columns: list) -> pa.Table:
+    """Converte o resultado de run_query (lista de tuplas) em uma pyarrow.Table colunar."""
+    if not rows:
+        return pa.table({c: [] for c in columns})
+    return pa.table(dict(zip(columns, map(list, zip(*rows)))))
+
+def get_table(key: str) -> pa.Table:
+    """Retorna st.session_state.data[key], carregando-a do banco se ainda não estiver lá."""
+    if key not in st.session_state.data:
+        st.session_state.data[key] = load_table(key)
+    return st.session_state.data[key]
+
+def table_to_df(key: str, columns: list) -> pd.DataFrame:
+    """
+    Retorna a pyarrow.Table de get_table(key) como DataFrame,
+    renomeando as colunas para `columns`. Vazio se a tabela não tiver linhas.
+    """
+    table = get_table(key)
+    if table.num_rows == 0:
+        return pd.DataFrame(columns=columns)
+    df = table.to_pandas()
+    df.columns = columns
+    return df
+
+# Consultas de load_all_data: chave -> (SQL, nomes das colunas)
+DATA_QUERIES = {
+    "orders": (
+        'SELECT "Cliente","Produto","Quantidade","Data",status FROM public.tb_pedido ORDER BY "Data" DESC',
+        ["Cliente", "Produto", "Quantidade", "Data", "status"],
+    ),
+    "recent_orders": (
+        'SELECT "Cliente","Produto","Quantidade","Data",status FROM public.tb_pedido ORDER BY "Data" DESC LIMIT 5',
+        ["Cliente", "Produto", "Quantidade", "Data", "status"],
+    ),
+    "products": (
+        'SELECT supplier, product, quantity, unit_value, custo_unitario, total_value, creation_date FROM public.tb_products ORDER BY creation_date DESC',
+        ["supplier", "product", "quantity", "unit_value", "custo_unitario", "total_value", "creation_date"],
+    ),
+    "clients": (
+        'SELECT DISTINCT "Cliente" FROM public.tb_pedido ORDER BY "Cliente"',
+        ["Cliente"],
+    ),
+    # ctid: endereço físico da linha, usado para editar/deletar sem varrer tb_estoque
+    "stock": (
+        'SELECT ctid::text,"Produto","Quantidade","Transação","Data" FROM public.tb_estoque ORDER BY "Data" DESC',
+        ["ctid", "Produto", "Quantidade", "Transação", "Data"],
+    ),
+}
+
+# Colunas de "stock" devolvidas pelas escritas em tb_estoque, para atualizar a tabela local
+STOCK_RETURNING = 'RETURNING ctid::text,"Produto","Quantidade","Transação","Data"'
+STOCK_ORDER = [("Data", "descending")]
+
+# As consultas de carga rodam a cada refresh_data: ficam preparadas em cada conexão do pool
+PREPARED_STATEMENTS.update({query: f"load_{key}" for key, (query, _) in DATA_QUERIES.items()})
+
+# Notas do caixa: soma por cliente e produto de todos os pedidos com `status` (um único round-trip
+# traz a lista de clientes e os itens de cada um)
+OPEN_INVOICES_QUERY = """
+    SELECT "Cliente", "Produto", SUM("Quantidade") AS qtd, SUM("total") AS total
+    FROM public.vw_pedido_produto
+    WHERE status=%s
+    GROUP BY "Cliente", "Produto"
+    ORDER BY "Cliente", "Produto"
+"""
+
+# Executada ao abrir o caixa: também fica preparada
+PREPARED_STATEMENTS[OPEN_INVOICES_QUERY] = "open_invoices"
+
+# Escritas mais frequentes (novo pedido, movimentações de estoque e pagamento no caixa)
+ORDER_INSERT_QUERY = """
+    INSERT INTO public.tb_pedido("Cliente","Produto","Quantidade","Data",status)
+    VALUES (%s,%s,%s,%s,'em aberto')
+"""
+STOCK_INSERT_QUERY = f"""
+    INSERT INTO public.tb_estoque("Produto","Quantidade","Transação","Data")
+    VALUES(%s,%s,%s,%s)
+    {STOCK_RETURNING}
+"""
+STOCK_UPDATE_QUERY = f"""
+    UPDATE public.tb_estoque
+    SET "Produto"=%s, "Quantidade"=%s, "Transação"=%s, "Data"=%s
+    WHERE ctid=%s::tid AND "Produto"=%s AND "Transação"=%s AND "Data"=%s
+    {STOCK_RETURNING}
+"""
+STOCK_DELETE_QUERY = """
+    DELETE FROM public.tb_estoque
+    WHERE ctid=%s::tid AND "Produto"=%s AND "Transação"=%s AND "Data"=%s
+    RETURNING ctid::text
+"""
+PAYMENT_QUERY = """
+    UPDATE public.tb_pedido
+    SET status=%s, "Data"=CURRENT_TIMESTAMP
+    WHERE "Cliente"=%s AND status='em aberto'
+    RETURNING "Cliente","Produto","Quantidade","Data",status
+"""
+
+# Rodam a cada submit: ficam preparadas como as leituras acima
+PREPARED_STATEMENTS.update({
+    ORDER_INSERT_QUERY: "insert_order",
+    STOCK_INSERT_QUERY: "insert_stock",
+    STOCK_UPDATE_QUERY: "update_stock",
+    STOCK_DELETE_QUERY: "delete_stock",
+    PAYMENT_QUERY: "payment",
+})
+
+# Chaves carregadas só quando alguma página as pede (get_table), e não em load_all_data
+LAZY_DATA_KEYS = {"orders"}
+
+def load_table(key: str) -> pa.Table:
+    """Executa a consulta de DATA_QUERIES[key] e retorna o resultado como pyarrow.Table."""
+    query, columns = DATA_QUERIES[key]
+    return rows_to_table(run_query(query), columns)
+
 @st.cache_data(show_spinner=False)
 def load_all_data():
     """
-    Carrega dados básicos (orders, products, clients, stock, revenue) do banco
-    e retorna em um dicionário. Usa caching para performance.
+    Carrega dados básicos (recent_orders, products, clients, stock) do banco
+    e retorna em um dicionário de pyarrow.Table. Usa caching para performance.
+    As chaves de LAZY_DATA_KEYS ficam de fora e são carregadas por get_table.
+    Levanta RuntimeError se alguma consulta falhar: exceções não ficam em cache,
+    então uma carga parcial nunca é servida às outras sessões (ver fresh_data).
+    """
+    eager = {key: spec for key, spec in DATA_QUERIES.items() if key not in LAZY_DATA_KEYS}
+    rows_by_key = run_many({key: query for key, (query, _) in eager.items()})
+    if not rows_by_key:
+        raise RuntimeError("não foi possível carregar as tabelas do banco")
+    return {key: rows_to_table(rows_by_key[key], columns) for key, (_, columns) in eager.items()}
+
+def fresh_data() -> dict:
+    """
+    Resultado de load_all_data, ou {} se a carga falhar: nesse caso get_table
+    busca cada tabela quando alguma página pedir.
     """
-    data = {}
     try:
-        data["orders"] = run_query(
-            'SELECT "Cliente","Produto","Quantidade","Data",status FROM public.tb_pedido ORDER BY "Data" DESC'
-        ) or []
-        data["products"] = run_query(
-            'SELECT supplier, product, quantity, unit_value, custo_unitario, total_value, creation_date FROM public.tb_products ORDER BY creation_date DESC'
-        ) or []
-        data["clients"] = run_query(
-            'SELECT DISTINCT "Cliente" FROM public.tb_pedido ORDER BY "Cliente"'
-        ) or []
-        data["stock"] = run_query(
-            'SELECT "Produto","Quantidade","Transação","Data" FROM public.tb_estoque ORDER BY "Data" DESC'
-        ) or []
-        data["revenue"] = run_query(
-            """
-            SELECT date("Data") as dt, SUM("total") as total_dia
-            FROM public.vw_pedido_produto
-            WHERE status IN ('Received - Debited','Received - Credit','Received - Pix','Received - Cash')
-            GROUP BY date("Data")
-            ORDER BY date("Data")
-            """
-        ) or pd.DataFrame()
+        return load_all_data()
     except Exception as e:
         st.error(f"Erro ao carregar dados: {e}")
-    return data
-
-def refresh_data():
+        return {}
+
+# Resumos da home (admin); TTL curto porque também mudam fora do aplicativo
+@st.cache_data(ttl=300, show_spinner=False)
+def get_open_orders_summary():
+    """Total em aberto por cliente (vw_pedido_produto)."""
+    return run_query("""
+        SELECT "Cliente", SUM("total") AS Total
+        FROM public.vw_pedido_produto
+        WHERE status=%s
+        GROUP BY "Cliente"
+        ORDER BY "Cliente" DESC
+    """, ('em aberto',))
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_stock_vs_orders_summary():
+    """
+    Saldo de estoque por produto (vw_stock_vs_orders_summary), já ordenado pelo banco.
+    A última coluna traz o total geral (SUM ... OVER ()), repetido em todas as linhas;
+    0 (e não NULL) quando não há saldo somável.
+    """
+    return run_query("""
+        SELECT product, stock_quantity, orders_quantity, total_in_stock,
+               COALESCE(SUM(total_in_stock) OVER (), 0) AS total_geral
+        FROM public.vw_stock_vs_orders_summary
+        ORDER BY total_in_stock DESC
+    """)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_profit_per_day():
+    """Valor, custo e lucro líquido por dia (vw_lucro_dia)."""
+    return run_query("""
+        SELECT "Data","Soma_Valor_total","Soma_Custo_total","Soma_Lucro_Liquido"
+        FROM public.vw_lucro_dia
+        ORDER BY "Data" DESC
+    """)
+
+# Listas das selectboxes de clientes; TTL curto porque tb_clientes também muda fora do aplicativo
+@st.cache_data(ttl=60, show_spinner=False)
+def get_client_names() -> list:
+    """Nomes de tb_clientes, em ordem alfabética."""
+    rows = run_query('SELECT nome_completo FROM public.tb_clientes ORDER BY nome_completo')
+    return [row[0] for row in rows] if rows else []
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_clients_listing():
+    """(nome_completo, email) de tb_clientes, dos mais recentes para os mais antigos."""
+    return run_query("SELECT nome_completo, email FROM public.tb_clientes ORDER BY data_cadastro DESC;")
+
+@st.cache_data(ttl=30, show_spinner=False)
+def get_open_invoices() -> dict:
+    """
+    {cliente: [(Produto, quantidade total, valor total), ...]} dos pedidos em aberto,
+    carregado de uma vez (OPEN_INVOICES_QUERY) para a lista e as notas do caixa.
+    """
+    invoices = {}
+    # Decimal/None do banco convertidos uma única vez aqui, e não a cada render do caixa
+    for cliente, produto, qtd, total in run_query(OPEN_INVOICES_QUERY, ('em aberto',)) or []:
+        invoices.setdefault(cliente, []).append((produto, int(qtd or 0), float(total or 0)))
+    return invoices
+
+def get_open_clients() -> list:
+    """Clientes com pedidos em aberto (vw_pedido_produto)."""
+    return list(get_open_invoices())
+
+# Leituras das páginas de eventos e fidelidade; limpas após as escritas correspondentes
+@st.cache_data(ttl=60, show_spinner=False)
+def get_events_from_db(year: int = None, month: int = None, limit: int = None):
+    """
+    Eventos de tb_eventos. Com year/month, só os do mês (filtro feito no banco, por
+    intervalo de datas, que aproveita índice em data_evento). Com limit, só os
+    `limit` mais recentes.
+    """
+    query = """
+        SELECT id, nome, descricao, data_evento, inscricao_aberta, data_criacao
+        FROM public.tb_eventos
+    """
+    values = []
+    if year and month:
+        inicio_mes = date(year, month, 1)
+        fim_mes = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+        query += " WHERE data_evento >= %s AND data_evento < %s ORDER BY data_evento"
+        values += [inicio_mes, fim_mes]
+    else:
+        query += " ORDER BY data_evento DESC"
+    if limit:
+        query += " LIMIT %s"
+        values.append(limit)
+    rows = run_query(query, tuple(values))
+    return rows if rows else []
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_loyalty_totals():
+    """Total gasto por cliente (vw_cliente_sum_total), para o programa de fidelidade."""
+    return run_query('SELECT "Cliente", total_geral FROM public.vw_cliente_sum_total;')
+
+def get_invoice(client: str) -> list:
+    """Itens em aberto de `client`, já somados por produto (de get_open_invoices)."""
+    return get_open_invoices().get(client, [])
+
+def clear_query_caches():
+    """Descarta os resultados em cache que dependem de pedidos e estoque."""
+    get_open_orders_summary.clear()
+    get_stock_vs_orders_summary.clear()
+    get_profit_per_day.clear()
+    get_open_invoices.clear()
+    get_loyalty_totals.clear()
+
+def clear_client_caches():
+    """Descarta as listas de clientes em cache (após inserir, editar ou deletar cliente)."""
+    get_client_names.clear()
+    get_clients_listing.clear()
+
+def refresh_data(scope: set | None = None):
     """
     Limpa o cache de load_all_data e atualiza st.session_state.data
     para refletir alterações no banco.
+    Com `scope` (ex.: {"stock"}), recarrega apenas essas chaves de DATA_QUERIES.
     """
     load_all_data.clear()
-    st.session_state.data = load_all_data()
+    clear_query_caches()
+    if scope is None:
+        st.session_state.data = fresh_data()
+    else:
+        for key in scope:
+            st.session_state.data[key] = load_table(key)
+    if scope is None or "products" in scope:
+        st.session_state.pop("product_list", None)
+        st.session_state.pop("product_index", None)
+
+def patch_table(key: str, match: dict | None = None, rows=None, sort_by=None, limit: int | None = None):
+    """
+    Atualiza st.session_state.data[key] localmente depois de uma escrita pontual,
+    sem reconsultar a tabela inteira: remove as linhas em que todas as colunas de
+    `match` ({coluna: valor}) batem e acrescenta `rows` (tuplas na ordem das colunas
+    de DATA_QUERIES[key], ex.: vindas de um RETURNING). `sort_by` e `limit` reaplicam
+    o ORDER BY / LIMIT da consulta original.
+    """
+    table = get_table(key)
+    if match and table.num_rows:
+        conditions = [pc.equal(table[column], value) for column, value in match.items()]
+        selected = conditions[0]
+        for condition in conditions[1:]:
+            selected = pc.and_(selected, condition)
+        table = table.filter(pc.invert(selected))
+    if rows:
+        new_rows = rows_to_table(rows, table.column_names)
+        table = pa.concat_tables([new_rows.cast(table.schema), table]) if table.num_rows else new_rows
+    if sort_by:
+        table = table.sort_by(sort_by)
+    if limit is not None:
+        table = table.slice(0, limit)
+    st.session_state.data[key] = table
+    load_all_data.clear()
+    clear_query_caches()
+
+def get_product_list():
+    """
+    Retorna a lista de nomes de produtos (ordem alfabética) guardada em st.session_state.
+    É montada a partir da tabela "products" já carregada, sem nova consulta ao banco;
+    refresh_data a descarta quando os produtos mudam.
+    """
+    if "product_list" not in st.session_state:
+        products = get_table("products")
+        product_list = sorted(products.column("product").to_pylist()) or ["No products"]
+        st.session_state.product_list = product_list
+        st.session_state.product_index = {p: i for i, p in enumerate(product_list)}
+    return st.session_state.product_list
+
+def get_product_index() -> dict:
+    """Retorna o mapa produto -> posição em get_product_list(), para o `index` das selectboxes."""
+    get_product_list()
+    return st.session_state.get("product_index", {})
 
 @st.cache_data(show_spinner=False)
 def get_latest_settings():
@@ -199,10 +907,7 @@ def get_latest_settings():
         ORDER BY id DESC
         LIMIT 1
     """
-    result = run_query(query)
-    if result:
-        return result[0]  # Now includes menu_color at index 7
-    return None
+    return run_query(query, one=True) or None  # menu_color no índice 7
 
 ###############################################################################
 #                           FUNÇÕES DE EMAIL
@@ -246,6 +951,110 @@ def send_email(name, user_email, message):
     except Exception as e:
         st.error(f"Falha ao enviar email: {e}")
 
+###############################################################################
+#                              AUTENTICAÇÃO
+###############################################################################
+def hash_password(password: str, salt: str) -> str:
+    """Retorna o hash blake2b (hex) da senha concatenada ao salt da instalação."""
+    return hashlib.blake2b(password.encode("utf-8") + salt.encode("utf-8")).hexdigest()
+
+def stored_password_hash(creds, role: str) -> str:
+    """
+    Retorna o hash da senha de `role` ("admin" ou "caixa") em st.secrets["credentials"].
+    Usa `<role>_password_hash` se existir; senão calcula a partir de `<role>_password`.
+    """
+    hashed = creds.get(f"{role}_password_hash")
+    if hashed:
+        return hashed
+    return hash_password(creds[f"{role}_password"], creds.get("password_salt", ""))
+
+def constant_time_equals(a: bytes, b: bytes) -> bool:
+    """
+    hmac.compare_digest sobre os dois lados completados com zeros até
+    CREDENTIAL_PAD_LENGTH e sufixados com o tamanho original, para que o tempo
+    da comparação não revele o tamanho do usuário digitado.
+    """
+    padded_a = a.ljust(CREDENTIAL_PAD_LENGTH, b"\x00") + bytes([len(a) & 0xFF])
+    padded_b = b.ljust(CREDENTIAL_PAD_LENGTH, b"\x00") + bytes([len(b) & 0xFF])
+    return hmac.compare_digest(padded_a, padded_b)
+
+@st.cache_resource
+def get_login_attempts():
+    """
+    Tabela compartilhada entre sessões (e threads do script):
+    (lock, {chave: (falhas, início da janela em time.monotonic())}).
+    Toda leitura/escrita da tabela é feita com o lock.
+    """
+    return threading.Lock(), {}
+
+def client_ip() -> str:
+    """
+    Chave do limite de tentativas de login para a sessão atual:
+    - o último IP do X-Forwarded-For (o que o proxy acrescentou; os anteriores vêm do cliente);
+    - sem proxy, o endereço da conexão do navegador;
+    - sem nenhum dos dois, a própria sessão (nunca uma chave única para todos).
+    """
+    try:
+        from streamlit.web.server.websocket_headers import _get_websocket_headers
+        headers = _get_websocket_headers() or {}
+    except ImportError:
+        headers = {}
+    forwarded = headers.get("X-Forwarded-For", "").split(",")[-1].strip()
+    if forwarded:
+        return forwarded
+
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return ""
+    try:
+        from streamlit.runtime import get_instance
+        client = get_instance().get_client(ctx.session_id)
+        remote_ip = getattr(getattr(client, "request", None), "remote_ip", None)
+    except Exception:
+        remote_ip = None
+    return remote_ip or f"session:{ctx.session_id}"
+
+def login_blocked(ip: str) -> bool:
+    """True se `ip` já errou LOGIN_MAX_ATTEMPTS vezes dentro da janela atual."""
+    lock, attempts = get_login_attempts()
+    with lock:
+        count, started = attempts.get(ip, (0, 0.0))
+    if time.monotonic() - started >= LOGIN_ATTEMPT_WINDOW:
+        return False
+    return count >= LOGIN_MAX_ATTEMPTS
+
+def record_login_failure(ip: str):
+    """Conta uma falha de login para `ip`, abrindo nova janela se a anterior expirou."""
+    lock, attempts = get_login_attempts()
+    now = time.monotonic()
+    with lock:
+        count, started = attempts.get(ip, (0, 0.0))
+        if now - started >= LOGIN_ATTEMPT_WINDOW:
+            count, started = 0, now
+        attempts[ip] = (count + 1, started)
+
+def clear_login_failures(ip: str):
+    """Zera as falhas de `ip` depois de um login bem-sucedido."""
+    lock, attempts = get_login_attempts()
+    with lock:
+        attempts.pop(ip, None)
+
+@st.cache_resource
+def get_login_credentials():
+    """
+    Lê st.secrets["credentials"] uma vez por processo e devolve
+    (salt, admin_user, admin_hash, caixa_user, caixa_hash), com usuários e hashes
+    já em bytes UTF-8 para o hmac.compare_digest. Levanta KeyError se faltar chave.
+    """
+    creds = st.secrets["credentials"]
+    return (
+        creds.get("password_salt", ""),
+        creds["admin_username"].encode("utf-8"),
+        stored_password_hash(creds, "admin").encode("utf-8"),
+        creds["caixa_username"].encode("utf-8"),
+        stored_password_hash(creds, "caixa").encode("utf-8"),
+    )
+
 ###############################################################################
 #                           PÁGINAS DO APLICATIVO
 ###############################################################################
@@ -286,25 +1095,18 @@ def home_page():
 
         # ------------------- Open Orders Summary -------------------
         with st.expander("Open Orders Summary"):
-            open_orders_query = """
-                SELECT "Cliente", SUM("total") AS Total
-                FROM public.vw_pedido_produto
-                WHERE status=%s
-                GROUP BY "Cliente"
-                ORDER BY "Cliente" DESC
-            """
-            open_orders_data = run_query(open_orders_query, ('em aberto',))
+            open_orders_data = get_open_orders_summary()
             if open_orders_data:
-                df_open = pd.DataFrame(open_orders_data, columns=["Client", "Total"])
+                # coerce_float converte os Decimal do psycopg2 direto para float64
+                df_open = pd.DataFrame.from_records(open_orders_data, columns=["Client", "Total"], coerce_float=True)
+                df_open["Total"] = df_open["Total"].fillna(0)
                 total_open = df_open["Total"].sum()
-                df_open["Total_display"] = df_open["Total"].apply(format_currency)
-                df_open = df_open[["Client", "Total_display"]].reset_index(drop=True)
-
-                styled_df_open = df_open.style.set_table_styles([
-                    {'selector': 'th', 'props': [('background-color', '#ff4c4c'), ('color', 'white'), ('padding', '8px')]},
-                    {'selector': 'td', 'props': [('padding', '8px'), ('text-align', 'right')]}
-                ])
-                st.write(styled_df_open)
+                st.dataframe(
+                    df_open,
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={"Total": st.column_config.NumberColumn(format="R$ %.2f")}
+                )
                 st.markdown(f"**Total Geral (Open Orders):** {format_currency(total_open)}")
             else:
                 st.info("Nenhum pedido em aberto encontrado.")
@@ -312,24 +1114,20 @@ def home_page():
         # ------------------- Stock vs. Orders Summary -------------------
         with st.expander("Stock vs. Orders Summary"):
             try:
-                stock_vs_orders_query = """
-                    SELECT product, stock_quantity, orders_quantity, total_in_stock
-                    FROM public.vw_stock_vs_orders_summary
-                """
-                stock_vs_orders_data = run_query(stock_vs_orders_query)
+                stock_vs_orders_data = get_stock_vs_orders_summary()
                 if stock_vs_orders_data:
-                    df_svo = pd.DataFrame(stock_vs_orders_data, columns=["Product", "Stock_Quantity", "Orders_Quantity", "Total_in_Stock"])
-                    df_svo = df_svo.sort_values("Total_in_Stock", ascending=False)
-                    df_display = df_svo[["Product", "Total_in_Stock"]]
-                    df_display["Total_in_Stock"] = df_display["Total_in_Stock"].apply(lambda x: f"{x:,}")
-                    df_display = df_display.reset_index(drop=True)
-
-                    styled_df_svo = df_display.style.set_table_styles([
-                        {'selector': 'th', 'props': [('background-color', '#ff4c4c'), ('color', 'white'), ('padding', '8px')]},
-                        {'selector': 'td', 'props': [('padding', '8px'), ('text-align', 'right')]}
-                    ])
-                    st.write(styled_df_svo)
-                    total_val = df_svo["Total_in_Stock"].sum()
+                    df_svo = pd.DataFrame.from_records(
+                        stock_vs_orders_data,
+                        columns=["Product", "Stock_Quantity", "Orders_Quantity", "Total_in_Stock", "Total_Geral"],
+                        coerce_float=True
+                    )
+                    st.dataframe(
+                        df_svo[["Product", "Total_in_Stock"]],
+                        use_container_width=True,
+                        hide_index=True,
+                        column_config={"Total_in_Stock": st.column_config.NumberColumn(format="%d")}
+                    )
+                    total_val = int(df_svo["Total_Geral"].iat[0])
                     st.markdown(f"**Total Geral (Stock vs. Orders):** {total_val:,}")
                 else:
                     st.info("View 'vw_stock_vs_orders_summary' sem dados ou inexistente.")
@@ -339,34 +1137,29 @@ def home_page():
         # --------------------- Profit per day ---------------------
         with st.expander("Profit per day"):
             try:
-                query_lucro = """
-                    SELECT "Data","Soma_Valor_total","Soma_Custo_total","Soma_Lucro_Liquido"
-                    FROM public.vw_lucro_dia
-                    ORDER BY "Data" DESC
-                """
-                data_lucro = run_query(query_lucro)
+                data_lucro = get_profit_per_day()
                 if data_lucro:
-                    df_lucro = pd.DataFrame(
+                    df_lucro = pd.DataFrame.from_records(
                         data_lucro,
-                        columns=["Data","Soma_Valor_total","Soma_Custo_total","Soma_Lucro_Liquido"]
+                        columns=["Data","Soma_Valor_total","Soma_Custo_total","Soma_Lucro_Liquido"],
+                        coerce_float=True
                     )
-                    df_lucro["Soma_Valor_total"] = pd.to_numeric(df_lucro["Soma_Valor_total"], errors="coerce").fillna(0)
-                    df_lucro["Soma_Custo_total"] = pd.to_numeric(df_lucro["Soma_Custo_total"], errors="coerce").fillna(0)
-                    df_lucro["Soma_Lucro_Liquido"] = pd.to_numeric(df_lucro["Soma_Lucro_Liquido"], errors="coerce").fillna(0)
+                    valores = ["Soma_Valor_total", "Soma_Custo_total", "Soma_Lucro_Liquido"]
+                    df_lucro[valores] = df_lucro[valores].fillna(0)
 
                     df_lucro.columns = ["Data", "Valor total", "Custo total", "Lucro líquido"]
-                    df_lucro["Valor total"] = df_lucro["Valor total"].apply(format_currency)
-                    df_lucro["Custo total"] = df_lucro["Custo total"].apply(format_currency)
-                    df_lucro["Lucro líquido"] = df_lucro["Lucro líquido"].apply(format_currency)
 
                     # Ordena por Data DESC
                     df_lucro = df_lucro.sort_values("Data", ascending=False)
 
-                    styled_df_lucro = df_lucro.style.set_table_styles([
-                        {'selector': 'th', 'props': [('background-color', '#ff4c4c'), ('color', 'white'), ('padding', '8px')]},
-                        {'selector': 'td', 'props': [('padding', '8px'), ('text-align', 'right')]}
-                    ])
-                    st.write(styled_df_lucro)
+                    # Valores seguem como float; a formatação em R$ fica a cargo do navegador
+                    brl = st.column_config.NumberColumn(format="R$ %.2f")
+                    st.dataframe(
+                        df_lucro,
+                        use_container_width=True,
+                        hide_index=True,
+                        column_config={"Valor total": brl, "Custo total": brl, "Lucro líquido": brl}
+                    )
                 else:
                     st.info("Nenhum dado encontrado em vw_lucro_dia.")
             except Exception as e:
@@ -385,12 +1178,14 @@ def orders_page():
     # ---------------------- Aba 0: Novo Pedido ----------------------
     with tabs[0]:
         st.subheader("Novo Pedido")
-        product_data = st.session_state.data.get("products", [])
-        product_list = [""] + [row[1] for row in product_data] if product_data else ["No products"]
+        if get_table("products").num_rows:
+            product_list = [""] + get_product_list()
+        else:
+            product_list = ["No products"]
 
         with st.form(key='order_form'):
-            clientes = run_query('SELECT nome_completo FROM public.tb_clientes ORDER BY nome_completo')
-            customer_list = [""] + [row[0] for row in clientes] if clientes else []
+            clientes = get_client_names()
+            customer_list = [""] + clientes if clientes else []
 
             col1, col2, col3 = st.columns(3)
             with col1:
@@ -402,26 +1197,21 @@ def orders_page():
 
             submit_button = st.form_submit_button("Registrar Pedido")
 
-        if submit_button:
+        if submit_button and first_submit("order_form", customer_name, product, quantity):
             if customer_name and product and quantity > 0:
-                query_insert = """
-                    INSERT INTO public.tb_pedido("Cliente","Produto","Quantidade","Data",status)
-                    VALUES (%s,%s,%s,%s,'em aberto')
-                """
-                success = run_query(query_insert, (customer_name, product, quantity, datetime.now()), commit=True)
+                success = run_query(ORDER_INSERT_QUERY, (customer_name, product, quantity, datetime.now()), commit=True)
                 if success:
                     st.toast("Pedido registrado com sucesso!")
-                    refresh_data()
+                    record_submit("order_form", customer_name, product, quantity)
+                    refresh_data(scope={"orders", "recent_orders", "clients"})
                 else:
                     st.error("Falha ao registrar pedido.")
             else:
                 st.warning("Preencha todos os campos.")
 
         st.subheader("Últimos 5 Pedidos Registrados")
-        orders_data = st.session_state.data.get("orders", [])
-        if orders_data:
-            df_recent_orders = pd.DataFrame(orders_data, columns=["Cliente","Produto","Quantidade","Data","Status"])
-            df_recent_orders = df_recent_orders.head(5)
+        df_recent_orders = table_to_df("recent_orders", ["Cliente","Produto","Quantidade","Data","Status"])
+        if not df_recent_orders.empty:
             st.write(df_recent_orders)
         else:
             st.info("Nenhum pedido encontrado.")
@@ -429,24 +1219,34 @@ def orders_page():
     # ---------------------- Aba 1: Listagem de Pedidos ----------------------
     with tabs[1]:
         st.subheader("Listagem de Pedidos")
-        orders_data = st.session_state.data.get("orders", [])
-        if orders_data:
-            cols = ["Cliente","Produto","Quantidade","Data","Status"]
-            df_orders = pd.DataFrame(orders_data, columns=cols)
+        df_orders = table_to_df("orders", ["Cliente","Produto","Quantidade","Data","Status"])
+        if not df_orders.empty:
             st.dataframe(df_orders, use_container_width=True)
-            download_df_as_csv(df_orders, "orders.csv", label="Baixar Pedidos CSV")
+            download_query_as_csv(
+                """
+                SELECT p."Cliente", p."Produto", p."Quantidade",
+                       to_char(p."Data", 'YYYY-MM-DD HH24:MI:SS') AS "Data", p.status AS "Status"
+                FROM public.tb_pedido p
+                ORDER BY p."Data" DESC
+                """,
+                "orders.csv",
+                label="Baixar Pedidos CSV"
+            )
 
             if st.session_state.get("username") == "admin":
                 st.markdown("### Editar ou Deletar Pedido")
-                df_orders["unique_key"] = df_orders.apply(
-                    lambda row: f"{row['Cliente']}|{row['Produto']}|{row['Data'].strftime('%Y-%m-%d %H:%M:%S')}",
-                    axis=1
+                df_orders["unique_key"] = (
+                    df_orders["Cliente"].astype(str) + "|" +
+                    df_orders["Produto"].astype(str) + "|" +
+                    pd.to_datetime(df_orders["Data"]).dt.strftime("%Y-%m-%d %H:%M:%S")
                 )
+                # Índice pela chave: a seleção vira um lookup em vez de varrer o DataFrame
+                df_orders = df_orders.set_index("unique_key", drop=False)
                 unique_keys = df_orders["unique_key"].unique().tolist()
                 selected_key = st.selectbox("Selecione Pedido", [""] + unique_keys)
 
                 if selected_key:
-                    match = df_orders[df_orders["unique_key"] == selected_key]
+                    match = df_orders.loc[[selected_key]]
                     if len(match) > 1:
                         st.warning("Múltiplos registros com a mesma chave.")
                     else:
@@ -460,25 +1260,14 @@ def orders_page():
                         with st.form(key='edit_order_form'):
                             col1, col2, col3 = st.columns(3)
                             with col1:
-                                product_data = st.session_state.data.get("products", [])
-                                product_list = [row[1] for row in product_data] if product_data else ["No products"]
-                                if original_product in product_list:
-                                    idx_prod = product_list.index(original_product)
-                                else:
-                                    idx_prod = 0
+                                product_list = get_product_list()
+                                idx_prod = get_product_index().get(original_product, 0)
                                 edit_prod = st.selectbox("Produto", product_list, index=idx_prod)
                             with col2:
                                 edit_qty = st.number_input("Quantidade", min_value=1, step=1, value=int(original_qty))
                             with col3:
-                                status_opts = [
-                                    "em aberto", "Received - Debited", "Received - Credit",
-                                    "Received - Pix", "Received - Cash"
-                                ]
-                                if original_status in status_opts:
-                                    idx_status = status_opts.index(original_status)
-                                else:
-                                    idx_status = 0
-                                edit_status = st.selectbox("Status", status_opts, index=idx_status)
+                                idx_status = ORDER_STATUS_INDEX.get(original_status, 0)
+                                edit_status = st.selectbox("Status", ORDER_STATUS_OPTIONS, index=idx_status)
 
                             col_upd, col_del = st.columns(2)
                             with col_upd:
@@ -494,7 +1283,7 @@ def orders_page():
                             success = run_query(q_del, (original_client, original_product, original_date), commit=True)
                             if success:
                                 st.toast("Pedido deletado com sucesso!")
-                                refresh_data()
+                                refresh_data(scope={"orders", "recent_orders", "clients"})
                             else:
                                 st.error("Falha ao deletar pedido.")
 
@@ -510,7 +1299,7 @@ def orders_page():
                             ), commit=True)
                             if success:
                                 st.toast("Pedido atualizado com sucesso!")
-                                refresh_data()
+                                refresh_data(scope={"orders", "recent_orders", "clients"})
                             else:
                                 st.error("Falha ao atualizar pedido.")
         else:
@@ -520,41 +1309,24 @@ def orders_page():
     with tabs[2]:
         st.subheader("Cash Number")
 
-        open_clients_query = 'SELECT DISTINCT "Cliente" FROM public.vw_pedido_produto WHERE status=%s'
-        open_clients = run_query(open_clients_query, ('em aberto',))
-        client_list = [row[0] for row in open_clients] if open_clients else []
+        client_list = get_open_clients()
         selected_client = st.selectbox("Selecione um Cliente", [""] + client_list)
 
         if selected_client:
-            invoice_query = """
-                SELECT "Produto", "Quantidade", "total"
-                FROM public.vw_pedido_produto
-                WHERE "Cliente"=%s AND status=%s
-            """
-            invoice_data = run_query(invoice_query, (selected_client, 'em aberto'))
+            invoice_data = get_invoice(selected_client)
             if invoice_data:
-                df = pd.DataFrame(invoice_data, columns=["Produto","Quantidade","total"])
-
-                df["total"] = pd.to_numeric(df["total"], errors="coerce").fillna(0)
-                total_sem_desconto = df["total"].sum()
-
-                cupons_validos = {
-                    "10": 0.10, "15": 0.15, "20": 0.20, "25": 0.25,
-                    "30": 0.30, "35": 0.35, "40": 0.40, "45": 0.45,
-                    "50": 0.50, "55": 0.55, "60": 0.60, "65": 0.65,
-                    "70": 0.70, "75": 0.75, "80": 0.80, "85": 0.85,
-                    "90": 0.90, "95": 0.95, "100":1.00,
-                }
+                total_sem_desconto = sum(row[2] for row in invoice_data)
+
                 coupon_code = st.text_input("CUPOM (desconto opcional)")
                 desconto_aplicado = 0.0
-                if coupon_code in cupons_validos:
-                    desconto_aplicado = cupons_validos[coupon_code]
+                if coupon_code in VALID_COUPONS:
+                    desconto_aplicado = VALID_COUPONS[coupon_code]
                     st.toast(f"Cupom {coupon_code} aplicado! Desconto de {desconto_aplicado*100:.0f}%")
 
                 total_com_desconto = total_sem_desconto * (1 - desconto_aplicado)
 
                 # Gerar Nota Fiscal para Impressora
-                generate_invoice_for_printer(df)
+                generate_invoice_for_printer(invoice_data)
 
                 st.write(f"**Total sem desconto:** {format_currency(total_sem_desconto)}")
                 st.write(f"**Desconto:** {desconto_aplicado*100:.0f}%")
@@ -601,7 +1373,7 @@ def products_page():
             creation_date = st.date_input("Data de Criação", value=date.today())
             submit_prod = st.form_submit_button("Inserir Produto")
 
-        if submit_prod:
+        if submit_prod and first_submit("product_form", supplier, product, quantity, unit_value, custo_unitario, creation_date):
             if supplier and product and quantity > 0 and unit_value >= 0 and custo_unitario >= 0:
                 total_value = quantity * unit_value
                 q_ins = """
@@ -612,7 +1384,8 @@ def products_page():
                 success = run_query(q_ins, (supplier, product, quantity, unit_value, custo_unitario, total_value, creation_date), commit=True)
                 if success:
                     st.toast("Produto adicionado com sucesso!")
-                    refresh_data()
+                    record_submit("product_form", supplier, product, quantity, unit_value, custo_unitario, creation_date)
+                    refresh_data(scope={"products"})
                 else:
                     st.error("Falha ao adicionar produto.")
             else:
@@ -621,23 +1394,25 @@ def products_page():
     # ---------------------- Aba [1]: Listagem de Produtos ----------------------
     with tabs[1]:
         st.subheader("Todos os Produtos")
-        products_data = st.session_state.data.get("products", [])
-        if products_data:
-            cols = ["Supplier","Product","Quantity","Unit Value","Custo Unitário","Total Value","Creation Date"]
-            df_prod = pd.DataFrame(products_data, columns=cols)
+        cols = ["Supplier","Product","Quantity","Unit Value","Custo Unitário","Total Value","Creation Date"]
+        df_prod = table_to_df("products", cols)
+        if not df_prod.empty:
             st.dataframe(df_prod, use_container_width=True)
             download_df_as_csv(df_prod, "products.csv", label="Baixar Produtos CSV")
 
             if st.session_state.get("username") == "admin":
                 st.markdown("### Editar / Deletar Produto")
-                df_prod["unique_key"] = df_prod.apply(
-                    lambda row: f"{row['Supplier']}|{row['Product']}|{row['Creation Date'].strftime('%Y-%m-%d')}",
-                    axis=1
+                df_prod["unique_key"] = (
+                    df_prod["Supplier"].astype(str) + "|" +
+                    df_prod["Product"].astype(str) + "|" +
+                    pd.to_datetime(df_prod["Creation Date"]).dt.strftime("%Y-%m-%d")
                 )
+                # Índice pela chave: a seleção vira um lookup em vez de varrer o DataFrame
+                df_prod = df_prod.set_index("unique_key", drop=False)
                 unique_keys = df_prod["unique_key"].unique().tolist()
                 selected_key = st.selectbox("Selecione Produto:", [""] + unique_keys)
                 if selected_key:
-                    match = df_prod[df_prod["unique_key"] == selected_key]
+                    match = df_prod.loc[[selected_key]]
                     if len(match) > 1:
                         st.warning("Múltiplos produtos com a mesma chave.")
                     else:
@@ -686,7 +1461,7 @@ def products_page():
                             ), commit=True)
                             if success:
                                 st.toast("Produto atualizado com sucesso!")
-                                refresh_data()
+                                refresh_data(scope={"products"})
                             else:
                                 st.error("Falha ao atualizar produto.")
 
@@ -700,7 +1475,7 @@ def products_page():
                             ), commit=True)
                             if success:
                                 st.toast("Produto deletado com sucesso!")
-                                refresh_data()
+                                refresh_data(scope={"products"})
                             else:
                                 st.error("Falha ao deletar produto.")
         else:
@@ -714,8 +1489,7 @@ def stock_page():
     # ---------------------- Aba [0]: Nova Movimentação ----------------------
     with tabs[0]:
         st.subheader("Registrar nova movimentação de estoque")
-        product_data = run_query("SELECT product FROM public.tb_products ORDER BY product;")
-        product_list = [row[0] for row in product_data] if product_data else ["No products"]
+        product_list = get_product_list()
 
         with st.form(key='stock_form'):
             col1, col2, col3, col4 = st.columns(4)
@@ -724,47 +1498,39 @@ def stock_page():
             with col2:
                 quantity = st.number_input("Quantidade", min_value=1, step=1)
             with col3:
-                transaction = st.selectbox("Tipo de Transação", ["Entrada","Saída"])
+                transaction = st.selectbox("Tipo de Transação", TRANSACTION_TYPES)
             with col4:
                 date_input = st.date_input("Data", value=datetime.now().date())
             submit_st = st.form_submit_button("Registrar")
 
-        if submit_st:
+        if submit_st and first_submit("stock_form", product, quantity, transaction, date_input):
             if product and quantity > 0:
                 current_datetime = datetime.combine(date_input, datetime.min.time())
-                q_ins = """
-                    INSERT INTO public.tb_estoque("Produto","Quantidade","Transação","Data")
-                    VALUES(%s,%s,%s,%s)
-                """
-                success = run_query(q_ins, (product, quantity, transaction, current_datetime), commit=True)
-                if success:
+                results = run_in_transaction([(STOCK_INSERT_QUERY, (product, quantity, transaction, current_datetime))])
+                if results is not None:
                     st.toast("Movimentação de estoque registrada com sucesso!")
-                    refresh_data()
+                    record_submit("stock_form", product, quantity, transaction, date_input)
+                    patch_table("stock", rows=results[0], sort_by=STOCK_ORDER)
                 else:
                     st.error("Falha ao registrar movimentação de estoque.")
             else:
                 st.warning("Selecione produto e quantidade > 0.")
 
         st.subheader("Stock vs. Orders Summary (por total_in_stock DESC)")
-        query_svo = """
-            SELECT product, stock_quantity, orders_quantity, total_in_stock
-            FROM public.vw_stock_vs_orders_summary
-            ORDER BY total_in_stock DESC
-        """
-        data_svo = run_query(query_svo)
+        data_svo = get_stock_vs_orders_summary()
         if data_svo:
-            df_svo = pd.DataFrame(data_svo, columns=["Product", "Stock_Quantity", "Orders_Quantity", "Total_in_Stock"])
-            df_svo = df_svo.sort_values("Total_in_Stock", ascending=False)
-            df_display = df_svo[["Product", "Total_in_Stock"]]
-            df_display["Total_in_Stock"] = df_display["Total_in_Stock"].apply(lambda x: f"{x:,}")
-            df_display = df_display.reset_index(drop=True)
-
-            styled_df_svo = df_display.style.set_table_styles([
-                {'selector': 'th', 'props': [('background-color', '#ff4c4c'), ('color', 'white'), ('padding', '8px')]},
-                {'selector': 'td', 'props': [('padding', '8px'), ('text-align', 'right')]}
-            ])
-            st.write(styled_df_svo)
-            total_val = df_svo["Total_in_Stock"].sum()
+            df_svo = pd.DataFrame.from_records(
+                data_svo,
+                columns=["Product", "Stock_Quantity", "Orders_Quantity", "Total_in_Stock", "Total_Geral"],
+                coerce_float=True
+            )
+            st.dataframe(
+                df_svo[["Product", "Total_in_Stock"]],
+                column_config={"Total_in_Stock": st.column_config.NumberColumn(format="%d")},
+                hide_index=True,
+                use_container_width=True
+            )
+            total_val = int(df_svo["Total_Geral"].iat[0])
             st.markdown(f"**Total Geral (Stock vs. Orders):** {total_val:,}")
         else:
             st.info("Nenhum dado encontrado em vw_stock_vs_orders_summary.")
@@ -772,92 +1538,105 @@ def stock_page():
     # ---------------------- Aba [1]: Movimentações ----------------------
     with tabs[1]:
         st.subheader("Movimentações de Estoque")
-        stock_data = st.session_state.data.get("stock", [])
-        if stock_data:
-            cols = ["Produto","Quantidade","Transação","Data"]
-            df_stock = pd.DataFrame(stock_data, columns=cols)
+        df_stock = table_to_df("stock", ["ctid","Produto","Quantidade","Transação","Data"])
+        if not df_stock.empty:
             df_stock["Data"] = pd.to_datetime(df_stock["Data"]).dt.strftime("%Y-%m-%d %H:%M:%S")
-            st.dataframe(df_stock, use_container_width=True)
-            download_df_as_csv(df_stock, "stock.csv", label="Baixar Stock CSV")
+            st.dataframe(
+                paginate_df(df_stock, "stock_page"),
+                column_config={"ctid": None, "Quantidade": st.column_config.NumberColumn(format="%d")},
+                use_container_width=True
+            )
+            download_query_as_csv(
+                """
+                SELECT e."Produto", e."Quantidade", e."Transação",
+                       to_char(e."Data", 'YYYY-MM-DD HH24:MI:SS') AS "Data"
+                FROM public.tb_estoque e
+                ORDER BY e."Data" DESC
+                """,
+                "stock.csv",
+                label="Baixar Stock CSV"
+            )
+            download_query_as_parquet(
+                'SELECT "Produto","Quantidade","Transação","Data" FROM public.tb_estoque ORDER BY "Data" DESC',
+                ["Produto", "Quantidade", "Transação", "Data"],
+                "stock.parquet",
+                label="Baixar Stock Parquet"
+            )
 
             if st.session_state.get("username") == "admin":
                 st.markdown("### Editar/Deletar Registro de Estoque")
-                df_stock["unique_key"] = df_stock.apply(
-                    lambda row: f"{row['Produto']}|{row['Transação']}|{row['Data']}",
-                    axis=1
+                # Opções são os ctids (um por linha, mesmo com Produto|Transação|Data repetidos);
+                # o texto Produto|Transação|Data é só o rótulo
+                df_stock = df_stock.set_index("ctid", drop=False)
+                stock_labels = (
+                    df_stock["Produto"].astype(str) + "|" +
+                    df_stock["Transação"].astype(str) + "|" +
+                    df_stock["Data"].astype(str)
+                ).to_dict()
+                selected_ctid = st.selectbox(
+                    "Selecione Registro",
+                    [None] + list(stock_labels),
+                    format_func=lambda ctid: "" if ctid is None else stock_labels[ctid]
                 )
-                unique_keys = df_stock["unique_key"].unique().tolist()
-                selected_key = st.selectbox("Selecione Registro", [""] + unique_keys)
-                if selected_key:
-                    match = df_stock[df_stock["unique_key"] == selected_key]
-                    if len(match) > 1:
-                        st.warning("Múltiplos registros com a mesma chave.")
-                    else:
-                        sel = match.iloc[0]
-                        original_product = sel["Produto"]
-                        original_qty = sel["Quantidade"]
-                        original_trans = sel["Transação"]
-                        original_date = sel["Data"]
-
-                        with st.form(key='edit_stock_form'):
-                            col1, col2, col3, col4 = st.columns(4)
-                            with col1:
-                                product_data = run_query("SELECT product FROM public.tb_products ORDER BY product;")
-                                product_list = [row[0] for row in product_data] if product_data else ["No products"]
-                                if original_product in product_list:
-                                    idx_prod = product_list.index(original_product)
-                                else:
-                                    idx_prod = 0
-                                edit_prod = st.selectbox("Produto", product_list, index=idx_prod)
-                            with col2:
-                                edit_qty = st.number_input("Quantidade", min_value=1, step=1, value=int(original_qty))
-                            with col3:
-                                if original_trans not in ["Entrada","Saída"]:
-                                    idx_trans = 0
-                                else:
-                                    idx_trans = ["Entrada","Saída"].index(original_trans)
-                                edit_trans = st.selectbox("Tipo", ["Entrada","Saída"], index=idx_trans)
-                            with col4:
-                                try:
-                                    old_date = datetime.strptime(original_date, "%Y-%m-%d %H:%M:%S").date()
-                                except ValueError:
-                                    old_date = date.today()
-                                edit_date = st.date_input("Data", value=old_date)
-
-                            col_upd, col_del = st.columns(2)
-                            with col_upd:
-                                update_btn = st.form_submit_button("Atualizar")
-                            with col_del:
-                                delete_btn = st.form_submit_button("Deletar")
-
-                        if update_btn:
-                            new_dt = datetime.combine(edit_date, datetime.min.time()).strftime("%Y-%m-%d %H:%M:%S")
-                            q_upd = """
-                                UPDATE public.tb_estoque
-                                SET "Produto"=%s, "Quantidade"=%s, "Transação"=%s, "Data"=%s
-                                WHERE "Produto"=%s AND "Transação"=%s AND "Data"=%s
-                            """
-                            success = run_query(q_upd, (
-                                edit_prod, edit_qty, edit_trans, new_dt,
-                                original_product, original_trans, original_date
-                            ), commit=True)
-                            if success:
-                                st.toast("Estoque atualizado com sucesso!")
-                                refresh_data()
-                            else:
-                                st.error("Falha ao atualizar estoque.")
-
-                        if delete_btn:
-                            q_del = """
-                                DELETE FROM public.tb_estoque
-                                WHERE "Produto"=%s AND "Transação"=%s AND "Data"=%s
-                            """
-                            success = run_query(q_del, (original_product, original_trans, original_date), commit=True)
-                            if success:
-                                st.toast("Registro deletado com sucesso!")
-                                refresh_data()
-                            else:
-                                st.error("Falha ao deletar registro.")
+                if selected_ctid is not None:
+                    sel = df_stock.loc[selected_ctid]
+                    original_ctid = sel["ctid"]
+                    original_product = sel["Produto"]
+                    original_qty = sel["Quantidade"]
+                    original_trans = sel["Transação"]
+                    original_date = sel["Data"]
+
+                    with st.form(key='edit_stock_form'):
+                        col1, col2, col3, col4 = st.columns(4)
+                        with col1:
+                            product_list = get_product_list()
+                            idx_prod = get_product_index().get(original_product, 0)
+                            edit_prod = st.selectbox("Produto", product_list, index=idx_prod)
+                        with col2:
+                            edit_qty = st.number_input("Quantidade", min_value=1, step=1, value=int(original_qty))
+                        with col3:
+                            idx_trans = TRANSACTION_INDEX.get(original_trans, 0)
+                            edit_trans = st.selectbox("Tipo", TRANSACTION_TYPES, index=idx_trans)
+                        with col4:
+                            try:
+                                old_date = datetime.strptime(original_date, "%Y-%m-%d %H:%M:%S").date()
+                            except ValueError:
+                                old_date = date.today()
+                            edit_date = st.date_input("Data", value=old_date)
+
+                        col_upd, col_del = st.columns(2)
+                        with col_upd:
+                            update_btn = st.form_submit_button("Atualizar")
+                        with col_del:
+                            delete_btn = st.form_submit_button("Deletar")
+
+                    if update_btn:
+                        new_dt = datetime.combine(edit_date, datetime.min.time()).strftime("%Y-%m-%d %H:%M:%S")
+                        results = run_in_transaction([(STOCK_UPDATE_QUERY, (
+                            edit_prod, edit_qty, edit_trans, new_dt,
+                            original_ctid, original_product, original_trans, original_date
+                        ))])
+                        if results is None:
+                            st.error("Falha ao atualizar estoque.")
+                        elif not results[0]:
+                            st.warning("Registro não encontrado (alterado por outro usuário?). Lista recarregada.")
+                            refresh_data(scope={"stock"})
+                        else:
+                            st.toast("Estoque atualizado com sucesso!")
+                            patch_table("stock", match={"ctid": original_ctid}, rows=results[0], sort_by=STOCK_ORDER)
+
+                    if delete_btn:
+                        results = run_in_transaction([(STOCK_DELETE_QUERY, (
+                            original_ctid, original_product, original_trans, original_date
+                        ))])
+                        if results is None:
+                            st.error("Falha ao deletar registro.")
+                        elif not results[0]:
+                            st.warning("Registro não encontrado (alterado por outro usuário?). Lista recarregada.")
+                            refresh_data(scope={"stock"})
+                        else:
+                            st.toast("Registro deletado com sucesso!")
+                            patch_table("stock", match={"ctid": original_ctid})
         else:
             st.info("Nenhuma movimentação de estoque encontrada.")
 
@@ -873,7 +1652,7 @@ def clients_page():
             nome_completo = st.text_input("Nome Completo")
             submit_client = st.form_submit_button("Registrar Cliente")
 
-        if submit_client:
+        if submit_client and first_submit("client_form", nome_completo):
             if nome_completo:
                 try:
                     data_nasc = date(2000,1,1)
@@ -893,7 +1672,8 @@ def clients_page():
                     success = run_query(q_ins, (nome_completo, data_nasc, genero, telefone, email, endereco), commit=True)
                     if success:
                         st.toast("Cliente registrado com sucesso!")
-                        refresh_data()
+                        record_submit("client_form", nome_completo)
+                        clear_client_caches()
                     else:
                         st.error("Falha ao registrar cliente.")
                 except Exception as e:
@@ -905,26 +1685,32 @@ def clients_page():
     with tabs[1]:
         st.subheader("Todos os Clientes")
         try:
-            clients_data = run_query("SELECT nome_completo, email FROM public.tb_clientes ORDER BY data_cadastro DESC;")
+            clients_data = get_clients_listing()
             if clients_data:
-                cols = ["Full Name","Email"]
-                df_clients = pd.DataFrame(clients_data, columns=cols)
-                st.dataframe(df_clients[["Full Name"]], use_container_width=True)
-                download_df_as_csv(df_clients[["Full Name"]], "clients.csv", label="Baixar Clients CSV")
+                # Só o nome é exibido: vai direto como coluna, sem montar um DataFrame
+                full_names = [row[0] for row in clients_data]
+                st.dataframe({"Full Name": paginate_df(full_names, "clients_page")}, use_container_width=True)
+                download_query_as_csv(
+                    'SELECT nome_completo AS "Full Name" FROM public.tb_clientes ORDER BY data_cadastro DESC',
+                    "clients.csv",
+                    label="Baixar Clients CSV"
+                )
 
                 if st.session_state.get("username") == "admin":
                     st.markdown("### Editar / Deletar Cliente")
-                    client_display = [""] + [f"{row['Full Name']} ({row['Email']})" for _, row in df_clients.iterrows()]
-                    selected_display = st.selectbox("Selecione Cliente:", client_display)
-                    if selected_display:
-                        try:
-                            original_name, original_email = selected_display.split(" (")
-                            original_email = original_email.rstrip(")")
-                        except ValueError:
-                            st.error("Seleção inválida.")
-                            st.stop()
-
-                        sel_row = df_clients[df_clients["Email"] == original_email].iloc[0]
+                    df_clients = pd.DataFrame(clients_data, columns=["Full Name", "Email"])
+                    client_display = (
+                        df_clients["Full Name"].astype(str) + " (" + df_clients["Email"].astype(str) + ")"
+                    ).tolist()
+                    # A selectbox devolve a posição da linha: sem reparsear o rótulo nem filtrar o DataFrame
+                    selected_pos = st.selectbox(
+                        "Selecione Cliente:",
+                        [None] + list(range(len(client_display))),
+                        format_func=lambda pos: "" if pos is None else client_display[pos]
+                    )
+                    if selected_pos is not None:
+                        sel_row = df_clients.iloc[selected_pos]
+                        original_email = sel_row["Email"]
                         with st.form(key='edit_client_form'):
                             edit_name = st.text_input("Nome Completo", value=sel_row["Full Name"])
                             col_upd, col_del = st.columns(2)
@@ -943,7 +1729,7 @@ def clients_page():
                                 success = run_query(q_upd, (edit_name, original_email), commit=True)
                                 if success:
                                     st.toast("Cliente atualizado com sucesso!")
-                                    refresh_data()
+                                    clear_client_caches()
                                 else:
                                     st.error("Falha ao atualizar cliente.")
 
@@ -953,8 +1739,8 @@ def clients_page():
                                 success = run_query(q_del, (original_email,), commit=True)
                                 if success:
                                     st.toast("Cliente deletado com sucesso!")
-                                    refresh_data()
-                                    st.experimental_rerun()
+                                    clear_client_caches()
+                                    rerun()
                                 else:
                                     st.error("Falha ao deletar cliente.")
                             except Exception as e:
@@ -967,41 +1753,24 @@ def clients_page():
 def cash_page():
     """Página para gerar e gerenciar notas fiscais."""
     st.title("Cash")
-    open_clients_query = 'SELECT DISTINCT "Cliente" FROM public.vw_pedido_produto WHERE status=%s'
-    open_clients = run_query(open_clients_query, ('em aberto',))
-    client_list = [row[0] for row in open_clients] if open_clients else []
+    client_list = get_open_clients()
     selected_client = st.selectbox("Selecione um Cliente", [""] + client_list)
 
     if selected_client:
-        invoice_query = """
-            SELECT "Produto", "Quantidade", "total"
-            FROM public.vw_pedido_produto
-            WHERE "Cliente"=%s AND status=%s
-        """
-        invoice_data = run_query(invoice_query, (selected_client, 'em aberto'))
+        invoice_data = get_invoice(selected_client)
         if invoice_data:
-            df = pd.DataFrame(invoice_data, columns=["Produto","Quantidade","total"])
+            total_sem_desconto = sum(row[2] for row in invoice_data)
 
-            df["total"] = pd.to_numeric(df["total"], errors="coerce").fillna(0)
-            total_sem_desconto = df["total"].sum()
-
-            cupons_validos = {
-                "10": 0.10, "15": 0.15, "20": 0.20, "25": 0.25,
-                "30": 0.30, "35": 0.35, "40": 0.40, "45": 0.45,
-                "50": 0.50, "55": 0.55, "60": 0.60, "65": 0.65,
-                "70": 0.70, "75": 0.75, "80": 0.80, "85": 0.85,
-                "90": 0.90, "95": 0.95, "100":1.00,
-            }
             coupon_code = st.text_input("CUPOM (desconto opcional)")
             desconto_aplicado = 0.0
-            if coupon_code in cupons_validos:
-                desconto_aplicado = cupons_validos[coupon_code]
+            if coupon_code in VALID_COUPONS:
+                desconto_aplicado = VALID_COUPONS[coupon_code]
                 st.toast(f"Cupom {coupon_code} aplicado! Desconto de {desconto_aplicado*100:.0f}%")
 
             total_com_desconto = total_sem_desconto * (1 - desconto_aplicado)
 
             # Gerar Nota Fiscal para Impressora
-            generate_invoice_for_printer(df)
+            generate_invoice_for_printer(invoice_data)
 
             st.write(f"**Total sem desconto:** {format_currency(total_sem_desconto)}")
             st.write(f"**Desconto:** {desconto_aplicado*100:.0f}%")
@@ -1027,6 +1796,8 @@ def cash_page():
 
 def analytics_page_content():
     """Função que contém o conteúdo da página Analytics para ser incluída no Home."""
+    import altair as alt  # Importado só quando os gráficos são desenhados (admin)
+
     st.header("Analytics")
 
     # Query para buscar os dados da view vw_pedido_produto_details
@@ -1128,12 +1899,8 @@ def analytics_page_content():
         # Formatação para exibição no gráfico
         df_daily["Data_formatada"] = df_daily["Data"].dt.strftime("%d/%m/%Y")
 
-        df_daily["Valor_total_formatado"] = df_daily["Valor_total"].apply(
-            lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-        )
-        df_daily["Lucro_Liquido_formatado"] = df_daily["Lucro_Liquido"].apply(
-            lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-        )
+        df_daily["Valor_total_formatado"] = format_currency_series(df_daily["Valor_total"])
+        df_daily["Lucro_Liquido_formatado"] = format_currency_series(df_daily["Lucro_Liquido"])
 
         # Transforma o DataFrame para o formato "long"
         df_long = df_daily.melt(
@@ -1143,9 +1910,7 @@ def analytics_page_content():
             value_name="Valor"
         )
 
-        df_long["Valor_formatado"] = df_long["Valor"].apply(
-            lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-        )
+        df_long["Valor_formatado"] = format_currency_series(df_long["Valor"])
 
         df_long["Métrica"] = pd.Categorical(
             df_long["Métrica"], categories=["Valor_total", "Lucro_Liquido"], ordered=True
@@ -1200,12 +1965,17 @@ def analytics_page_content():
         # Profit per Day Table
         # --------------------------
 
-        df_daily_table = df_daily.copy()
-        df_daily_table["Data"] = df_daily_table["Data"].dt.strftime("%d/%m/%Y")
-        df_daily_table["Valor total"] = df_daily_table["Valor_total"].apply(format_currency)
-        df_daily_table["Lucro líquido"] = df_daily_table["Lucro_Liquido"].apply(format_currency)
-        df_daily_table = df_daily_table[["Data", "Valor total", "Lucro líquido"]]
-        st.table(df_daily_table)
+        # Valores numéricos com formato R$ na coluna; st.dataframe só desenha as linhas visíveis
+        st.dataframe(
+            df_daily[["Data_formatada", "Valor_total", "Lucro_Liquido"]].astype({"Valor_total": float, "Lucro_Liquido": float}),
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "Data_formatada": st.column_config.TextColumn("Data"),
+                "Valor_total": st.column_config.NumberColumn("Valor total", format="R$ %.2f"),
+                "Lucro_Liquido": st.column_config.NumberColumn("Lucro líquido", format="R$ %.2f"),
+            }
+        )
 
         # --------------------------
         # Most Profitable Products Chart
@@ -1222,9 +1992,7 @@ def analytics_page_content():
             ])
             df_produtos = df_produtos.sort_values("Total_Lucro", ascending=False)
             df_produtos_top5 = df_produtos.head(5)
-            df_produtos_top5["Total_Lucro_formatado"] = df_produtos_top5["Total_Lucro"].apply(
-                lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-            )
+            df_produtos_top5["Total_Lucro_formatado"] = format_currency_series(df_produtos_top5["Total_Lucro"])
 
             chart_produtos = alt.Chart(df_produtos_top5).mark_bar(color="#1b4f72").encode(
                 x=alt.X("Total_Lucro:Q", title="Lucro Total (R$)"),
@@ -1260,9 +2028,7 @@ def analytics_page_content():
             }).reset_index()
 
             # Formata os valores monetários
-            df_status_lucro["Lucro_Liquido_formatado"] = df_status_lucro["Lucro_Liquido"].apply(
-                lambda x: format_currency(x)
-            )
+            df_status_lucro["Lucro_Liquido_formatado"] = format_currency_series(df_status_lucro["Lucro_Liquido"])
 
             # Cria o Donut Chart usando Altair
             donut_chart = alt.Chart(df_status_lucro).mark_arc(innerRadius=50).encode(
@@ -1364,15 +2130,6 @@ def events_calendar_page():
     """Página para gerenciar o calendário de eventos."""
     st.title("Calendário de Eventos")
 
-    def get_events_from_db():
-        query = """
-            SELECT id, nome, descricao, data_evento, inscricao_aberta, data_criacao
-            FROM public.tb_eventos
-            ORDER BY data_evento;
-        """
-        rows = run_query(query)
-        return rows if rows else []
-
     st.subheader("Agendar Novo Evento")
     with st.form(key="new_event_form"):
         col1, col2 = st.columns(2)
@@ -1384,7 +2141,7 @@ def events_calendar_page():
             descricao_evento = st.text_area("Descrição do Evento")
         btn_cadastrar = st.form_submit_button("Agendar")
 
-    if btn_cadastrar:
+    if btn_cadastrar and first_submit("new_event_form", nome_evento, data_evento):
         if nome_evento.strip():
             q_insert = """
                 INSERT INTO public.tb_eventos
@@ -1394,7 +2151,9 @@ def events_calendar_page():
             success = run_query(q_insert, (nome_evento, descricao_evento, data_evento, inscricao_aberta), commit=True)
             if success:
                 st.toast("Evento cadastrado com sucesso!")
-                st.experimental_rerun()
+                record_submit("new_event_form", nome_evento, data_evento)
+                get_events_from_db.clear()
+                rerun()
             else:
                 st.error("Falha ao cadastrar evento.")
         else:
@@ -1414,39 +2173,28 @@ def events_calendar_page():
             index=2
         )
     with col_mes:
-        meses_nomes = [calendar.month_name[i] for i in range(1, 13)]
         mes_selecionado = st.selectbox(
             "Selecione o Mês",
-            options=list(range(1, 13)),
-            format_func=lambda x: meses_nomes[x-1],
+            options=MONTHS,
+            format_func=MONTH_NAMES.get,
             index=mes_padrao - 1
         )
 
-    event_rows = get_events_from_db()
-    if not event_rows:
-        st.info("Nenhum evento cadastrado.")
-        return
-
-    df_events = pd.DataFrame(
-        event_rows,
-        columns=["id", "nome", "descricao", "data_evento", "inscricao_aberta", "data_criacao"]
-    )
-    df_events["data_evento"] = pd.to_datetime(df_events["data_evento"], errors="coerce")
+    event_columns = ["id", "nome", "descricao", "data_evento", "inscricao_aberta", "data_criacao"]
 
-    # Filtrar eventos com base no ano e mês selecionados
-    df_filtrado = df_events[
-        (df_events["data_evento"].dt.year == ano_selecionado) &
-        (df_events["data_evento"].dt.month == mes_selecionado)
-    ].copy()
+    # Apenas os eventos do mês selecionado vêm do banco
+    df_filtrado = pd.DataFrame(get_events_from_db(ano_selecionado, mes_selecionado), columns=event_columns)
+    df_filtrado["data_evento"] = pd.to_datetime(df_filtrado["data_evento"], errors="coerce")
 
     # Agrupar e contar eventos por dia
     event_counts = df_filtrado.groupby(df_filtrado["data_evento"].dt.day).size().to_dict()
 
     st.subheader("Visualização do Calendário")
 
-    cal = calendar.HTMLCalendar(firstweekday=0)
-    # Usar o mês e ano selecionados
-    html_calendario = cal.formatmonth(ano_selecionado, mes_selecionado)
+    # HTML do mês com os dias de evento marcados (em cache por ano, mês e contagens)
+    html_calendario = render_events_calendar(
+        ano_selecionado, mes_selecionado, tuple((int(d), int(c)) for d, c in sorted(event_counts.items()))
+    )
 
     # Definir o estilo para dias com eventos
     css_custom = """
@@ -1503,14 +2251,6 @@ def events_calendar_page():
     """
     st.markdown(css_custom, unsafe_allow_html=True)
 
-    for dia, count in event_counts.items():
-        # Criar a string de substituição com a contagem de eventos
-        # Formato esperado: <td>dia</td>
-        target = f'<td>{dia}</td>'
-        # Substituir por: <td class="event-day" title="X evento(s)">dia<br/><span>X</span></td>
-        replacement = f'<td class="event-day" title="{count} evento(s)">{dia}<br/><span>{count}</span></td>'
-        # Substituir apenas a primeira ocorrência para evitar múltiplas substituições
-        html_calendario = html_calendario.replace(target, replacement, 1)
 
     st.markdown(html_calendario, unsafe_allow_html=True)
     st.markdown("<br>", unsafe_allow_html=True)
@@ -1540,22 +2280,30 @@ def events_calendar_page():
     st.markdown("---")
     st.subheader("Editar / Excluir Eventos")
 
-    df_events["evento_label"] = df_events.apply(
-        lambda row: f'{row["id"]} - {row["nome"]} ({row["data_evento"].strftime("%Y-%m-%d")})',
-        axis=1
-    )
-    events_list = [""] + df_events["evento_label"].tolist()
-    selected_event = st.selectbox("Selecione um evento:", events_list)
+    # Lista de edição limitada aos eventos mais recentes
+    event_rows = get_events_from_db(limit=EVENTS_EDIT_LIMIT)
+    if not event_rows:
+        st.info("Nenhum evento cadastrado.")
+        return
 
-    if selected_event:
-        event_id_str = selected_event.split(" - ")[0]
-        try:
-            event_id = int(event_id_str)
-        except ValueError:
-            st.error("Falha ao interpretar ID do evento.")
-            return
+    df_events = pd.DataFrame(event_rows, columns=event_columns)
+    df_events["data_evento"] = pd.to_datetime(df_events["data_evento"], errors="coerce")
 
-        ev_row = df_events[df_events["id"] == event_id].iloc[0]
+    df_events["evento_label"] = (
+        df_events["id"].astype(str) + " - " + df_events["nome"].astype(str) +
+        " (" + df_events["data_evento"].dt.strftime("%Y-%m-%d").fillna("") + ")"
+    )
+    # Opções são os próprios ids; o rótulo vem de um dict, sem reparsear o texto selecionado
+    df_events = df_events.set_index("id", drop=False)
+    event_labels = df_events["evento_label"].to_dict()
+    event_id = st.selectbox(
+        "Selecione um evento:",
+        [None] + list(event_labels),
+        format_func=lambda ev_id: "" if ev_id is None else event_labels[ev_id]
+    )
+
+    if event_id is not None:
+        ev_row = df_events.loc[event_id]
         original_nome = ev_row["nome"]
         original_desc = ev_row["descricao"]
         original_data = ev_row["data_evento"]
@@ -1582,7 +2330,8 @@ def events_calendar_page():
                         success = run_query(q_update, (new_nome, new_desc, new_data, new_insc, event_id), commit=True)
                         if success:
                             st.toast("Evento atualizado com sucesso!")
-                            st.experimental_rerun()
+                            get_events_from_db.clear()
+                            rerun()
                         else:
                             st.error("Falha ao atualizar evento.")
                     else:
@@ -1594,7 +2343,8 @@ def events_calendar_page():
                     success = run_query(q_delete, (event_id,), commit=True)
                     if success:
                         st.toast(f"Evento ID={event_id} excluído com sucesso!")
-                        st.experimental_rerun()
+                        get_events_from_db.clear()
+                        rerun()
                     else:
                         st.error("Falha ao excluir evento.")
     else:
@@ -1604,8 +2354,7 @@ def loyalty_program_page():
     """Página do programa de fidelidade."""
     st.title("Programa de Fidelidade")
 
-    query = 'SELECT "Cliente", total_geral FROM public.vw_cliente_sum_total;'
-    data = run_query(query)
+    data = get_loyalty_totals()
     if data:
         df = pd.DataFrame(data, columns=["Cliente", "Total Geral"])
         st.subheader("Clientes - Fidelidade")
@@ -1702,80 +2451,91 @@ def settings_page():
             else:
                 st.warning("Por favor, forneça pelo menos o nome da empresa.")
 
-def login_page():
-    """Página de login do aplicativo."""
-    from PIL import Image
-    import requests
-    from io import BytesIO
-    from datetime import datetime
-
-    st.markdown(
-        """
-        <style>
-        .block-container {
-            max-width: 450px;
-            margin: 0 auto;
-            padding-top: 40px;
-        }
-        .css-18e3th9 {
-            font-size: 1.75rem;
-            font-weight: 600;
-            text-align: center;
-        }
-        .btn {
-            background-color: #ff4c4c !important; 
-            padding: 8px 16px !important;
-            font-size: 0.875rem !important;
-            color: white !important;
-            border: none;
-            border-radius: 4px;
-            font-weight: bold;
-            text-align: center;
-            cursor: pointer;
-            width: 100%;
-        }
-        .btn:hover {
-            background-color: #cc0000 !important; 
-        }
-        .footer {
-            position: fixed;
-            left: 0; 
-            bottom: 0; 
-            width: 100%;
-            text-align: center;
-            font-size: 12px;
-            color: #999;
-        }
-        input::placeholder {
-            color: #bbb;
-            font-size: 0.875rem;
-        }
-        .css-1siy2j8 {
-            gap: 0.1rem !important;
-        }
-        .css-1siy2j8 input {
-            margin-bottom: 0 !important; 
-            padding-top: 4px;
-            padding-bottom: 4px;
-        }
-        </style>
-        """,
-        unsafe_allow_html=True
-    )
-
-    logo_url = "https://via.placeholder.com/300x100?text=Boituva+Beach+Club"
-    logo = None
+LOGO_URL = "https://via.placeholder.com/300x100?text=Boituva+Beach+Club"
+
+# Estilo e rodapé fixos da tela de login (montados uma vez, no import)
+LOGIN_CSS = """
+<style>
+.block-container {
+    max-width: 450px;
+    margin: 0 auto;
+    padding-top: 40px;
+}
+.css-18e3th9 {
+    font-size: 1.75rem;
+    font-weight: 600;
+    text-align: center;
+}
+.btn {
+    background-color: #ff4c4c !important; 
+    padding: 8px 16px !important;
+    font-size: 0.875rem !important;
+    color: white !important;
+    border: none;
+    border-radius: 4px;
+    font-weight: bold;
+    text-align: center;
+    cursor: pointer;
+    width: 100%;
+}
+.btn:hover {
+    background-color: #cc0000 !important; 
+}
+.footer {
+    position: fixed;
+    left: 0; 
+    bottom: 0; 
+    width: 100%;
+    text-align: center;
+    font-size: 12px;
+    color: #999;
+}
+input::placeholder {
+    color: #bbb;
+    font-size: 0.875rem;
+}
+.css-1siy2j8 {
+    gap: 0.1rem !important;
+}
+.css-1siy2j8 input {
+    margin-bottom: 0 !important; 
+    padding-top: 4px;
+    padding-bottom: 4px;
+}
+</style>
+"""
+
+LOGIN_HEADER = LOGIN_CSS + "<p style='text-align: center;'>🌴keep the beach vibes flowing!🎾</p>"
+
+LOGIN_FOOTER = """
+<div class='footer'>
+    © 2025 | Todos os direitos reservados | Boituva Beach Club
+</div>
+"""
+
+@st.cache_data(ttl=86400, show_spinner=False)
+def load_logo(url: str):
+    """
+    Baixa o logo uma vez por dia (por processo) em vez de a cada rerun da tela de login.
+    Em caso de falha retorna None, que também fica em cache: sem rede, o timeout é
+    pago uma vez e não a cada interação.
+    """
     try:
-        resp = requests.get(logo_url, timeout=5)
-        if resp.status_code == 200:
-            logo = Image.open(BytesIO(resp.content))
-    except:
-        pass
+        resp = get_http_session().get(url, timeout=5)
+        resp.raise_for_status()
+    except requests.RequestException:
+        return None
+    return resp.content
 
+def login_page():
+    """Página de login do aplicativo."""
+    logo = load_logo(LOGO_URL)
     if logo:
+        # st.image aceita os bytes do PNG direto, sem decodificar com PIL a cada rerun
         st.image(logo, use_column_width=True)
 
-    st.markdown("<p style='text-align: center;'>🌴keep the beach vibes flowing!🎾</p>", unsafe_allow_html=True)
+    # CSS + slogan num único elemento (o <style> vale para a página toda onde quer que esteja)
+    st.markdown(LOGIN_HEADER, unsafe_allow_html=True)
 
     with st.form("login_form", clear_on_submit=False):
         username_input = st.text_input("", placeholder="Username")
@@ -1803,49 +2563,61 @@ def login_page():
                     st.warning("Please fill in all fields.")
 
     if btn_login:
+        login_started = time.perf_counter()
         if not username_input or not password_input:
             st.error("Por favor, preencha todos os campos.")
         else:
             try:
-                creds = st.secrets["credentials"]
-                admin_user = creds["admin_username"]
-                admin_pass = creds["admin_password"]
-                caixa_user = creds["caixa_username"]
-                caixa_pass = creds["caixa_password"]
+                salt, admin_user, admin_hash, caixa_user, caixa_hash = get_login_credentials()
             except KeyError:
                 st.error("Credenciais não encontradas em st.secrets['credentials']. Verifique a configuração.")
                 st.stop()
 
-            import hmac
+            # Sem chave (fora de uma sessão do Streamlit) não há limite por origem
+            ip = client_ip()
+            if ip and login_blocked(ip):
+                st.error("Muitas tentativas de login. Aguarde um minuto e tente novamente.")
+                st.stop()
+
+            input_user = username_input.encode("utf-8")
+            input_hash = hash_password(password_input, salt).encode("utf-8")
+
+            def verify_credentials(actual_user, actual_hash):
+                # Compara bytes (aceita não-ASCII) e usa & para não curto-circuitar
+                user_ok = constant_time_equals(input_user, actual_user)
+                pass_ok = constant_time_equals(input_hash, actual_hash)
+                return user_ok & pass_ok
 
-            def verify_credentials(input_user, input_pass, actual_user, actual_pass):
-                return hmac.compare_digest(input_user, actual_user) and hmac.compare_digest(input_pass, actual_pass)
+            # Avalia os dois perfis antes de decidir, para o tempo não depender de qual casou
+            is_admin = verify_credentials(admin_user, admin_hash)
+            is_caixa = verify_credentials(caixa_user, caixa_hash)
+
+            # Espera até o piso fixo antes de responder, mascarando a variação restante
+            time.sleep(max(0.0, LOGIN_MIN_SECONDS - (time.perf_counter() - login_started)))
+
+            if ip and (is_admin | is_caixa):
+                clear_login_failures(ip)
 
             # Verifica ADMIN
-            if verify_credentials(username_input, password_input, admin_user, admin_pass):
+            if is_admin:
                 st.session_state.logged_in = True
                 st.session_state.username = "admin"
                 st.session_state.login_time = datetime.now()
-                st.toast("Login bem-sucedido como ADMIN!")
-                st.experimental_rerun()
+                st.session_state["_flash"] = ("toast", "Login bem-sucedido como ADMIN!")
+                rerun()
             # Verifica CAIXA
-            elif verify_credentials(username_input, password_input, caixa_user, caixa_pass):
+            elif is_caixa:
                 st.session_state.logged_in = True
                 st.session_state.username = "caixa"
                 st.session_state.login_time = datetime.now()
-                st.toast("Login bem-sucedido como CAIXA!")
-                st.experimental_rerun()
+                st.session_state["_flash"] = ("toast", "Login bem-sucedido como CAIXA!")
+                rerun()
             else:
+                if ip:
+                    record_login_failure(ip)
                 st.error("Usuário ou senha incorretos.")
 
-    st.markdown(
-        """
-        <div class='footer'>
-            © 2025 | Todos os direitos reservados | Boituva Beach Club
-        </div>
-        """,
-        unsafe_allow_html=True
-    )
+    st.markdown(LOGIN_FOOTER, unsafe_allow_html=True)
 
 def main():
     """
@@ -1860,6 +2632,11 @@ def main():
         login_page()
         return
 
+    # Mensagem agendada antes de um rerun (ex.: login) é mostrada uma única vez aqui
+    flash = st.session_state.pop("_flash", None)
+    if flash:
+        getattr(st, flash[0])(flash[1])
+
     # Caso logado, cria barra lateral e seleciona página
     selected_page = sidebar_navigation()
 
@@ -1897,7 +2674,7 @@ def main():
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
             st.toast("Desconectado com sucesso!")
-            st.experimental_rerun()
+            rerun()
 
 ###############################################################################
 #                     FUNÇÕES DE INICIALIZAÇÃO
@@ -1910,7 +2687,7 @@ def initialize_session_state():
     - last_settings: configurações mais recentes
     """
     if 'data' not in st.session_state:
-        st.session_state.data = load_all_data()
+        st.session_state.data = fresh_data()
     if 'logged_in' not in st.session_state:
         st.session_state.logged_in = False
     if 'last_settings' not in st.session_state:
@@ -2006,15 +2783,8 @@ def sidebar_navigation():
     with st.sidebar:
         selected = option_menu(
             "Bar Menu",
-            [
-                "Home", "Orders", "Products", "Stock", "Clients",
-                "Cash", "Analytics", "Calendário de Eventos",
-                "Settings", "Loyalty Program"
-            ],
-            icons=[
-                "house","file-text","box","list-task","layers",
-                "receipt","bar-chart","calendar","gear", "star"
-            ],
+            list(MENU_PAGES),
+            icons=list(MENU_ICONS),
             menu_icon="cast",
             default_index=0,
             styles={
@@ -2041,24 +2811,27 @@ def sidebar_navigation():
 ###############################################################################
 def process_payment(client: str, payment_status: str):
     """
-    Atualiza status de pedido em aberto -> payment_status, chama refresh_data() e st.experimental_rerun().
-    """
-    query = """
-        UPDATE public.tb_pedido
-        SET status=%s, "Data"=CURRENT_TIMESTAMP
-        WHERE "Cliente"=%s AND status='em aberto'
+    Atualiza status de pedido em aberto -> payment_status, corrige as tabelas locais de pedidos
+    com as linhas do RETURNING e chama rerun().
     """
-    success = run_query(query, (payment_status, client), commit=True)
-    if success:
+    # O RETURNING devolve os pedidos já atualizados: as tabelas locais são corrigidas
+    # com eles, sem reler tb_pedido
+    results = run_in_transaction([(PAYMENT_QUERY, (payment_status, client))])
+    if results is not None:
         st.toast(f"Pagamento via {payment_status.split('-')[-1].strip()} processado com sucesso!")
-        refresh_data()
-        st.experimental_rerun()
+        paid = {"Cliente": client, "status": "em aberto"}
+        order = [("Data", "descending")]
+        if "orders" in st.session_state.data:
+            patch_table("orders", match=paid, rows=results[0], sort_by=order)
+        patch_table("recent_orders", match=paid, rows=results[0], sort_by=order, limit=5)
+        rerun()
     else:
         st.error("Falha ao processar pagamento.")
 
-def generate_invoice_for_printer(df: pd.DataFrame):
+def generate_invoice_for_printer(rows: list):
     """
-    Gera texto simulando uma nota fiscal para exibição. 
+    Gera texto simulando uma nota fiscal para exibição.
+    `rows` já vem agregado do banco: (Produto, quantidade total (int), valor total (float)).
     """
     company = "Boituva Beach Club"
     address = "Avenida do Trabalhador 1879"
@@ -2066,35 +2839,37 @@ def generate_invoice_for_printer(df: pd.DataFrame):
     cnpj = "05.365.434/0001-09"
     phone = "(13) 99154-5481"
 
-    invoice = []
-    invoice.append("==================================================")
-    invoice.append("                      NOTA FISCAL                ")
-    invoice.append("==================================================")
-    invoice.append(f"Empresa: {company}")
-    invoice.append(f"Endereço: {address}")
-    invoice.append(f"Cidade: {city}")
-    invoice.append(f"CNPJ: {cnpj}")
-    invoice.append(f"Telefone: {phone}")
-    invoice.append("--------------------------------------------------")
-    invoice.append("DESCRIÇÃO             QTD     TOTAL")
-    invoice.append("--------------------------------------------------")
-
-    df["total"] = pd.to_numeric(df["total"], errors="coerce").fillna(0)
-    grouped_df = df.groupby("Produto").agg({"Quantidade": "sum", "total": "sum"}).reset_index()
-    total_general = 0
-    for _, row in grouped_df.iterrows():
-        description = f"{row['Produto'][:20]:<20}"
-        quantity = f"{int(row['Quantidade']):>5}"
-        total_item = row["total"]
-        total_general += total_item
-        total_formatted = format_currency(total_item)
-        invoice.append(f"{description} {quantity} {total_formatted}")
-
-    invoice.append("--------------------------------------------------")
-    invoice.append(f"{'TOTAL GERAL:':>30} {format_currency(total_general):>10}")
-    invoice.append("==================================================")
-    invoice.append("OBRIGADO PELA SUA PREFERÊNCIA!")
-    invoice.append("==================================================")
+    totals = [total for _, _, total in rows]
+    # Totais formatados de uma vez (format_currency_series), sem format_currency por item
+    totals_fmt = format_currency_series(pd.Series(totals, dtype="float64")).tolist()
+    item_lines = [
+        INVOICE_LINE_TEMPLATE.format_map({
+            "descricao": produto[:20],
+            "qtd": qtd,
+            "total": total_fmt,
+        })
+        for (produto, qtd, _), total_fmt in zip(rows, totals_fmt)
+    ]
+
+    invoice = [
+        "==================================================",
+        "                      NOTA FISCAL                ",
+        "==================================================",
+        f"Empresa: {company}",
+        f"Endereço: {address}",
+        f"Cidade: {city}",
+        f"CNPJ: {cnpj}",
+        f"Telefone: {phone}",
+        "--------------------------------------------------",
+        "DESCRIÇÃO             QTD     TOTAL",
+        "--------------------------------------------------",
+        *item_lines,
+        "--------------------------------------------------",
+        f"{'TOTAL GERAL:':>30} {format_currency(sum(totals)):>10}",
+        "==================================================",
+        "OBRIGADO PELA SUA PREFERÊNCIA!",
+        "==================================================",
+    ]
 
     st.text("\n".join(invoice))
 
@@ -1,16 +1,22 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from streamlit_option_menu import option_menu
 import psycopg2
 from psycopg2 import OperationalError
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from datetime import datetime, date, timedelta
 import pandas as pd
-from PIL import Image
 import requests
-from io import BytesIO
 from fpdf import FPDF
 import os
+import re
 import uuid
+import hashlib
+import hmac
+import time
+import threading
 import calendar
+from functools import lru_cache
 import altair as alt
 import numpy as np
 from sklearn.linear_model import LinearRegression
@@ -24,9 +30,29 @@ from mitosheet.streamlit.v1.spreadsheet import _get_mito_backend
 #############################################################################
 #                                   UTILIDADES
 ###############################################################################
+# st.rerun (Streamlit 1.27+) quando existir; senão o antigo st.experimental_rerun
+rerun = getattr(st, "rerun", None) or st.experimental_rerun
+
+# Troca separadores en-US ("1,234.56") pelos brasileiros ("1.234,56") em uma única passada
+_BRL_SEPARATORS = str.maketrans({",": ".", ".": ","})
+
 def format_currency(value: float) -> str:
     """Formata um valor float para o formato de moeda brasileira."""
-    return f"R$ {value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    return f"R$ {value:,.2f}".translate(_BRL_SEPARATORS)
+
+# Insere "." como separador de milhar na parte inteira ("1234567" -> "1.234.567")
+_THOUSANDS_PATTERN = r"\B(?=(\d{3})+(?!\d))"
+
+def format_currency_series(s: pd.Series) -> pd.Series:
+    """
+    Versão vetorizada de format_currency para uma coluna inteira.
+    Trabalha em centavos inteiros, sem chamar format_currency linha a linha.
+    """
+    cents = (pd.to_numeric(s, errors="coerce").fillna(0) * 100).round().astype("int64")
+    sinal = cents.lt(0).map({True: "-", False: ""})
+    inteiro = (cents.abs() // 100).astype(str).str.replace(_THOUSANDS_PATTERN, ".", regex=True)
+    centavos = (cents.abs() % 100).astype(str).str.zfill(2)
+    return "R$ " + sinal + inteiro + "," + centavos
 
 def download_df_as_csv(df: pd.DataFrame, filename: str, label: str = "Baixar CSV"):
     """Permite o download de um DataFrame como CSV."""
@@ -38,11 +64,6 @@ def download_df_as_json(df: pd.DataFrame, filename: str, label: str = "Baixar JS
     json_data = df.to_json(orient='records', lines=False)  # Ajustado para JSON padrão
     st.download_button(label=label, data=json_data, file_name=filename, mime="application/json")
 
-def download_df_as_html(df: pd.DataFrame, filename: str, label: str = "Baixar HTML"):
-    """Permite o download de um DataFrame como HTML."""
-    html_data = df.to_html(index=False)
-    st.download_button(label=label, data=html_data, file_name=filename, mime="text/html")
-
 def download_df_as_parquet(df: pd.DataFrame, filename: str, label: str = "Baixar Parquet"):
     """Permite o download de um DataFrame como Parquet."""
     import io
@@ -70,14 +91,22 @@ def convert_df_to_pdf(df: pd.DataFrame) -> bytes:
         pdf.cell(60, 10, str(column), border=1)
     pdf.ln()
 
-    # Linhas
-    for _, row in df.iterrows():
+    # Linhas: converte tudo para texto de uma vez, sem montar uma Series por linha
+    for row in df.astype(str).to_numpy():
         for item in row:
-            pdf.cell(60, 10, str(item), border=1)
+            pdf.cell(60, 10, item, border=1)
         pdf.ln()
 
     return pdf.output(dest='S')
 
+@st.cache_resource(show_spinner=False)
+def get_http_session() -> requests.Session:
+    """
+    Sessão HTTP compartilhada (por processo), que mantém as conexões TCP/TLS abertas
+    entre chamadas em vez de refazer o handshake a cada requisição.
+    """
+    return requests.Session()
+
 def upload_pdf_to_fileio(pdf_bytes: bytes) -> str:
     """Faz upload de um PDF para o file.io e retorna o link."""
     try:
@@ -130,21 +159,59 @@ def send_whatsapp(recipient_number: str, media_url: str = None):
 ###############################################################################
 #                            CONEXÃO COM BANCO
 ###############################################################################
+# Tamanho máximo do pool, compartilhado por todas as sessões; acima disso os pedidos
+# esperam uma vaga (até DB_CHECKOUT_TIMEOUT segundos) em vez de falhar
+DB_POOL_MAX = 20
+DB_CHECKOUT_TIMEOUT = 10
+
+@st.cache_resource(show_spinner=False)
+def get_pool():
+    """Cria uma única vez (por processo) o pool de conexões com o PostgreSQL (1 a DB_POOL_MAX conexões)."""
+    return ThreadedConnectionPool(
+        1, DB_POOL_MAX,
+        host=st.secrets["db"]["host"],
+        database=st.secrets["db"]["name"],
+        user=st.secrets["db"]["user"],
+        password=st.secrets["db"]["password"],
+        port=st.secrets["db"]["port"]
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_pool_slots() -> threading.BoundedSemaphore:
+    """
+    Uma vaga por conexão do pool. O ThreadedConnectionPool levanta PoolError assim
+    que esgota, então get_db_connection espera uma vaga aqui antes do getconn.
+    """
+    return threading.BoundedSemaphore(DB_POOL_MAX)
+
 def get_db_connection():
-    """Estabelece conexão com o banco de dados PostgreSQL usando as credenciais do Streamlit Secrets."""
+    """
+    Retorna uma conexão do pool, esperando até DB_CHECKOUT_TIMEOUT segundos por uma vaga.
+    Deve ser devolvida com release_db_connection().
+    """
+    slots = get_pool_slots()
+    if not slots.acquire(timeout=DB_CHECKOUT_TIMEOUT):
+        st.error("Banco de dados ocupado no momento. Tente novamente em instantes.")
+        return None
     try:
-        conn = psycopg2.connect(
-            host=st.secrets["db"]["host"],
-            database=st.secrets["db"]["name"],
-            user=st.secrets["db"]["user"],
-            password=st.secrets["db"]["password"],
-            port=st.secrets["db"]["port"]
-        )
-        return conn
+        return get_pool().getconn()
     except Exception as e:
+        slots.release()
         st.error(f"Falha na conexão com o banco de dados: {e}")
         return None
 
+def release_db_connection(conn):
+    """Devolve a conexão ao pool e libera a vaga; conexões fechadas ou quebradas são descartadas."""
+    if conn is None:
+        return
+    try:
+        get_pool().putconn(conn, close=bool(conn.closed))
+    except Exception:
+        if not conn.closed:
+            conn.close()
+    finally:
+        get_pool_slots().release()
+
 def run_query(query: str, values=None, commit: bool = False):
     """
     Executa uma query no banco de dados.
@@ -164,50 +231,319 @@ def run_query(query: str, values=None, commit: bool = False):
             else:
                 return cursor.fetchall()
     except Exception as e:
+        if isinstance(e, (OperationalError, psycopg2.InterfaceError)) and not conn.closed:
+            conn.close()
         st.error(f"Erro ao executar query: {e}")
         return None
     finally:
-        if conn and not conn.closed:
-            conn.close()
-    return None
+        release_db_connection(conn)
 
 ###############################################################################
 #                         CARREGAMENTO DE DADOS (CACHE)
 ###############################################################################
+# Consulta de cada chave de st.session_state.data
+DATA_QUERIES = {
+    "orders": 'SELECT "Cliente","Produto","Quantidade","Data",status FROM public.tb_pedido ORDER BY "Data" DESC',
+    "products": 'SELECT supplier, product, quantity, unit_value, custo_unitario, total_value, creation_date FROM public.tb_products ORDER BY creation_date DESC',
+    "clients": 'SELECT DISTINCT "Cliente" FROM public.tb_pedido ORDER BY "Cliente"',
+    "stock": 'SELECT "Produto","Quantidade","Transação","Data" FROM public.tb_estoque ORDER BY "Data" DESC',
+    "revenue": """
+        SELECT date("Data") as dt, SUM("total") as total_dia
+        FROM public.vw_pedido_produto
+        WHERE status IN ('Received - Debited','Received - Credit','Received - Pix','Received - Cash')
+        GROUP BY date("Data")
+        ORDER BY date("Data")
+    """,
+}
+
 @st.cache_data(show_spinner=False)  # Não exibir spinner
 def load_all_data():
     """Carrega todos os dados necessários do banco de dados e armazena no session_state."""
     data = {}
     try:
-        data["orders"] = run_query(
-            'SELECT "Cliente","Produto","Quantidade","Data",status FROM public.tb_pedido ORDER BY "Data" DESC'
-        ) or []
-        data["products"] = run_query(
-            'SELECT supplier, product, quantity, unit_value, custo_unitario, total_value, creation_date FROM public.tb_products ORDER BY creation_date DESC'
-        ) or []
-        data["clients"] = run_query(
-            'SELECT DISTINCT "Cliente" FROM public.tb_pedido ORDER BY "Cliente"'
-        ) or []
-        data["stock"] = run_query(
-            'SELECT "Produto","Quantidade","Transação","Data" FROM public.tb_estoque ORDER BY "Data" DESC'
-        ) or []
-        data["revenue"] = run_query(
-            """
-            SELECT date("Data") as dt, SUM("total") as total_dia
-            FROM public.vw_pedido_produto
-            WHERE status IN ('Received - Debited','Received - Credit','Received - Pix','Received - Cash')
-            GROUP BY date("Data")
-            ORDER BY date("Data")
-            """
-        ) or pd.DataFrame()
+        for key, query in DATA_QUERIES.items():
+            data[key] = run_query(query) or []
     except Exception as e:
         st.error(f"Erro ao carregar dados: {e}")
     return data
 
-def refresh_data():
-    """Atualiza os dados armazenados no session_state."""
+# Resumos da home (admin); TTL curto porque também mudam fora do aplicativo
+@st.cache_data(ttl=300, show_spinner=False)
+def get_open_orders_summary():
+    """Total em aberto por cliente (vw_pedido_produto)."""
+    return run_query("""
+        SELECT "Cliente", SUM("total") AS Total
+        FROM public.vw_pedido_produto
+        WHERE status=%s
+        GROUP BY "Cliente"
+        ORDER BY "Cliente" DESC
+    """, ('em aberto',))
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_stock_vs_orders_summary():
+    """
+    Saldo de estoque por produto (vw_stock_vs_orders_summary), já ordenado pelo banco.
+    A última coluna traz o total geral (SUM ... OVER ()), repetido em todas as linhas;
+    0 (e não NULL) quando não há saldo somável.
+    """
+    return run_query("""
+        SELECT product, stock_quantity, orders_quantity, total_in_stock,
+               COALESCE(SUM(total_in_stock) OVER (), 0) AS total_geral
+        FROM public.vw_stock_vs_orders_summary
+        ORDER BY total_in_stock DESC
+    """)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_invoiced_per_day():
+    """Total recebido por dia (vw_pedido_produto, pedidos já pagos)."""
+    return run_query("""
+        SELECT date("Data") as dt, SUM("total") as total_dia
+        FROM public.vw_pedido_produto
+        WHERE status IN ('Received - Debited','Received - Credit','Received - Pix','Received - Cash')
+        GROUP BY date("Data")
+        ORDER BY date("Data")
+    """)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_month_events(year: int, month: int):
+    """(nome, descricao, data_evento) dos eventos do mês, filtrando pelo intervalo de datas."""
+    first_day = date(year, month, 1)
+    next_month = date(year + month // 12, month % 12 + 1, 1)
+    return run_query("""
+        SELECT nome, descricao, data_evento
+        FROM public.tb_eventos
+        WHERE data_evento >= %s AND data_evento < %s
+        ORDER BY data_evento
+    """, (first_day, next_month))
+
+# Seleção de cliente no caixa; limpas em process_payment e refresh_data
+OPEN_CLIENTS_QUERY = 'SELECT DISTINCT "Cliente" FROM public.vw_pedido_produto WHERE status=%s'
+INVOICE_QUERY = """
+    SELECT "Produto", COALESCE(SUM("Quantidade"), 0) AS qtd, COALESCE(SUM("total"), 0) AS total
+    FROM public.vw_pedido_produto
+    WHERE "Cliente"=%s AND status=%s
+    GROUP BY "Produto"
+    ORDER BY "Produto"
+"""
+
+@st.cache_data(ttl=30, show_spinner=False)
+def get_open_clients() -> list:
+    """Clientes com pedidos em aberto (vw_pedido_produto)."""
+    rows = run_query(OPEN_CLIENTS_QUERY, ('em aberto',))
+    return [row[0] for row in rows] if rows else []
+
+@st.cache_data(ttl=30, show_spinner=False)
+def get_invoice(client: str):
+    """Itens em aberto de `client`, já somados por produto no banco."""
+    return run_query(INVOICE_QUERY, (client, 'em aberto'))
+
+def refresh_data(scope: set | None = None):
+    """
+    Atualiza os dados armazenados no session_state.
+    Com `scope` (ex.: {"stock"}), recarrega apenas essas chaves de DATA_QUERIES.
+    """
     load_all_data.clear()
-    st.session_state.data = load_all_data()
+    get_open_orders_summary.clear()
+    get_stock_vs_orders_summary.clear()
+    get_invoiced_per_day.clear()
+    get_open_clients.clear()
+    get_invoice.clear()
+    if scope is None:
+        st.session_state.data = load_all_data()
+    else:
+        for key in scope:
+            st.session_state.data[key] = run_query(DATA_QUERIES[key]) or []
+
+###############################################################################
+#                               CALENDÁRIO
+###############################################################################
+# Célula de dia gerada por calendar.HTMLCalendar, ex.: <td class="mon">5</td>
+CALENDAR_DAY_CELL = re.compile(r'<td class="(mon|tue|wed|thu|fri|sat|sun)">(\d+)</td>')
+
+# CSS do calendário da home. Precisa ser reenviado a cada rerun: o Streamlit remove
+# do front-end os elementos que não são redesenhados na execução atual.
+CALENDAR_CSS = """
+<style>
+table {
+    width: 100%;  /* Ocupa toda a largura da coluna */
+    border-collapse: collapse;
+    font-size: 12px;  /* Mantém o tamanho da fonte */
+}
+th {
+    background-color: #1b4f72;
+    color: white;
+    padding: 5px;
+}
+td {
+    width: 14.28%;
+    height: 45px;  /* Reduzida a altura das células */
+    text-align: center;
+    vertical-align: top;
+    border: 1px solid #ddd;
+}
+@media only screen and (max-width: 600px) {
+    table {
+        font-size: 10px;
+    }
+    td {
+        height: 35px;
+    }
+}
+</style>
+"""
+
+# Texto reduzido da tabela de últimos pedidos (orders_page)
+SMALL_FONT_CSS = """
+<style>
+.small-font {
+    font-size:10px;
+}
+</style>
+"""
+
+@lru_cache(maxsize=32)
+def month_html(year: int, month: int) -> str:
+    """HTML do mês gerado por calendar.HTMLCalendar; só depende de (ano, mês)."""
+    return calendar.HTMLCalendar(firstweekday=0).formatmonth(year, month)
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def render_month_calendar(year: int, month: int, events: tuple) -> str:
+    """
+    Gera o HTML do calendário do mês com os dias de evento destacados em azul.
+    `events` é uma tupla de (nome, descricao, data_evento); se houver mais de um
+    evento no mesmo dia, o título usa o primeiro.
+    """
+    event_days = {}
+    for nome, descricao, data_evento in events:
+        event_days.setdefault(data_evento.day, (nome, descricao))
+
+    def highlight(match):
+        dia = int(match.group(2))
+        if dia not in event_days:
+            return match.group(0)
+        nome, descricao = event_days[dia]
+        return (
+            f'<td class="{match.group(1)}" style="background-color:#1b4f72; color:white; font-weight:bold;" '
+            f'title="{nome}: {descricao}">{dia}</td>'
+        )
+
+    html_calendario = month_html(year, month)
+    # Uma única passada sobre o HTML, em vez de um replace por evento e dia da semana
+    return CALENDAR_DAY_CELL.sub(highlight, html_calendario)
+
+###############################################################################
+#                              AUTENTICAÇÃO
+###############################################################################
+# Usuário/hash do login são completados até este tamanho (bytes) antes da comparação
+CREDENTIAL_PAD_LENGTH = 64
+
+# Toda tentativa de login leva pelo menos este tempo (s), acertando ou não a senha
+LOGIN_MIN_SECONDS = 0.25
+
+# Após LOGIN_MAX_ATTEMPTS falhas do mesmo IP em LOGIN_ATTEMPT_WINDOW segundos, o login é recusado
+LOGIN_MAX_ATTEMPTS = 5
+LOGIN_ATTEMPT_WINDOW = 60
+
+def hash_password(password: str, salt: str) -> str:
+    """Retorna o hash blake2b (hex) da senha concatenada ao salt da instalação."""
+    return hashlib.blake2b(password.encode("utf-8") + salt.encode("utf-8")).hexdigest()
+
+def stored_password_hash(creds, role: str) -> str:
+    """
+    Retorna o hash da senha de `role` ("admin" ou "caixa") em st.secrets["credentials"].
+    Usa `<role>_password_hash` se existir; senão calcula a partir de `<role>_password`.
+    """
+    hashed = creds.get(f"{role}_password_hash")
+    if hashed:
+        return hashed
+    return hash_password(creds[f"{role}_password"], creds.get("password_salt", ""))
+
+def constant_time_equals(a: bytes, b: bytes) -> bool:
+    """
+    hmac.compare_digest sobre os dois lados completados com zeros até
+    CREDENTIAL_PAD_LENGTH e sufixados com o tamanho original, para que o tempo
+    da comparação não revele o tamanho do usuário digitado.
+    """
+    padded_a = a.ljust(CREDENTIAL_PAD_LENGTH, b"\x00") + bytes([len(a) & 0xFF])
+    padded_b = b.ljust(CREDENTIAL_PAD_LENGTH, b"\x00") + bytes([len(b) & 0xFF])
+    return hmac.compare_digest(padded_a, padded_b)
+
+@st.cache_resource
+def get_login_attempts():
+    """
+    Tabela compartilhada entre sessões (e threads do script):
+    (lock, {chave: (falhas, início da janela em time.monotonic())}).
+    Toda leitura/escrita da tabela é feita com o lock.
+    """
+    return threading.Lock(), {}
+
+def client_ip() -> str:
+    """
+    Chave do limite de tentativas de login para a sessão atual:
+    - o último IP do X-Forwarded-For (o que o proxy acrescentou; os anteriores vêm do cliente);
+    - sem proxy, o endereço da conexão do navegador;
+    - sem nenhum dos dois, a própria sessão (nunca uma chave única para todos).
+    """
+    try:
+        from streamlit.web.server.websocket_headers import _get_websocket_headers
+        headers = _get_websocket_headers() or {}
+    except ImportError:
+        headers = {}
+    forwarded = headers.get("X-Forwarded-For", "").split(",")[-1].strip()
+    if forwarded:
+        return forwarded
+
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return ""
+    try:
+        from streamlit.runtime import get_instance
+        client = get_instance().get_client(ctx.session_id)
+        remote_ip = getattr(getattr(client, "request", None), "remote_ip", None)
+    except Exception:
+        remote_ip = None
+    return remote_ip or f"session:{ctx.session_id}"
+
+def login_blocked(ip: str) -> bool:
+    """True se `ip` já errou LOGIN_MAX_ATTEMPTS vezes dentro da janela atual."""
+    lock, attempts = get_login_attempts()
+    with lock:
+        count, started = attempts.get(ip, (0, 0.0))
+    if time.monotonic() - started >= LOGIN_ATTEMPT_WINDOW:
+        return False
+    return count >= LOGIN_MAX_ATTEMPTS
+
+def record_login_failure(ip: str):
+    """Conta uma falha de login para `ip`, abrindo nova janela se a anterior expirou."""
+    lock, attempts = get_login_attempts()
+    now = time.monotonic()
+    with lock:
+        count, started = attempts.get(ip, (0, 0.0))
+        if now - started >= LOGIN_ATTEMPT_WINDOW:
+            count, started = 0, now
+        attempts[ip] = (count + 1, started)
+
+def clear_login_failures(ip: str):
+    """Zera as falhas de `ip` depois de um login bem-sucedido."""
+    lock, attempts = get_login_attempts()
+    with lock:
+        attempts.pop(ip, None)
+
+@st.cache_resource
+def get_login_credentials():
+    """
+    Lê st.secrets["credentials"] uma vez por processo e devolve
+    (salt, admin_user, admin_hash, caixa_user, caixa_hash), com usuários e hashes
+    já em bytes UTF-8 para o hmac.compare_digest. Levanta KeyError se faltar chave.
+    """
+    creds = st.secrets["credentials"]
+    return (
+        creds.get("password_salt", ""),
+        creds["admin_username"].encode("utf-8"),
+        stored_password_hash(creds, "admin").encode("utf-8"),
+        creds["caixa_username"].encode("utf-8"),
+        stored_password_hash(creds, "caixa").encode("utf-8"),
+    )
 
 ###############################################################################
 #                           PÁGINAS DO APLICATIVO
@@ -221,72 +557,19 @@ def home_page():
     ano_atual = current_date.year
     mes_atual = current_date.month
 
-    # Obter eventos do banco de dados para o mês atual
-    events_query = """
-        SELECT nome, descricao, data_evento 
-        FROM public.tb_eventos 
-        WHERE EXTRACT(YEAR FROM data_evento) = %s AND EXTRACT(MONTH FROM data_evento) = %s
-        ORDER BY data_evento
-    """
-    events_data = run_query(events_query, (ano_atual, mes_atual))
+    # Obter eventos do banco de dados para o mês atual (em cache)
+    events_data = get_month_events(ano_atual, mes_atual)
 
     # Criar duas colunas: uma para o calendário e outra para a lista de eventos
     col_calendar, col_events = st.columns([1, 1], gap="large")  # Proporção 50% para calendário e 50% para eventos
 
     with col_calendar:
         if events_data:
-            # Gerar o calendário HTML com dias de eventos destacados
-            cal = calendar.HTMLCalendar(firstweekday=0)
-            html_calendario = cal.formatmonth(ano_atual, mes_atual)
-
-            # Destacar dias com eventos em azul
-            for ev in events_data:
-                nome, descricao, data_evento = ev
-                dia = data_evento.day
-                # Ajustar a cor de fundo para azul e o texto para branco
-                highlight_str = (
-                    f' style="background-color:#1b4f72; color:white; font-weight:bold;" '
-                    f'title="{nome}: {descricao}"'
-                )
-                # Substituir as tags <td class="mon">dia</td>, <td class="tue">dia</td>, etc.
-                for day_class in ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]:
-                    target = f'<td class="{day_class}">{dia}</td>'
-                    replacement = f'<td class="{day_class}"{highlight_str}>{dia}</td>'
-                    html_calendario = html_calendario.replace(target, replacement)
+            # Gerar o calendário HTML com dias de eventos destacados (em cache)
+            html_calendario = render_month_calendar(ano_atual, mes_atual, tuple(events_data))
 
             # Adicionar CSS para estilizar o calendário
-            st.markdown(
-                """
-                <style>
-                table {
-                    width: 100%;  /* Ocupa toda a largura da coluna */
-                    border-collapse: collapse;
-                    font-size: 12px;  /* Mantém o tamanho da fonte */
-                }
-                th {
-                    background-color: #1b4f72;
-                    color: white;
-                    padding: 5px;
-                }
-                td {
-                    width: 14.28%;
-                    height: 45px;  /* Reduzida a altura das células */
-                    text-align: center;
-                    vertical-align: top;
-                    border: 1px solid #ddd;
-                }
-                @media only screen and (max-width: 600px) {
-                    table {
-                        font-size: 10px;
-                    }
-                    td {
-                        height: 35px;
-                    }
-                }
-                </style>
-                """,
-                unsafe_allow_html=True
-            )
+            st.markdown(CALENDAR_CSS, unsafe_allow_html=True)
 
             st.markdown(html_calendario, unsafe_allow_html=True)
 
@@ -317,34 +600,19 @@ def home_page():
         # Exibir as três seções uma abaixo da outra
         # ======================= Open Orders Summary =======================
         with st.expander("Open Orders Summary"):
-            open_orders_query = """
-                SELECT "Cliente", SUM("total") AS Total
-                FROM public.vw_pedido_produto
-                WHERE status=%s
-                GROUP BY "Cliente"
-                ORDER BY "Cliente" DESC
-            """
-            open_orders_data = run_query(open_orders_query, ('em aberto',))
+            open_orders_data = get_open_orders_summary()
             if open_orders_data:
-                df_open = pd.DataFrame(open_orders_data, columns=["Client", "Total"])
+                df_open = pd.DataFrame.from_records(open_orders_data, columns=["Client", "Total"], coerce_float=True)
+                df_open["Total"] = df_open["Total"].fillna(0)
                 total_open = df_open["Total"].sum()
 
-                # Formatar a coluna para exibição
-                df_open["Total_display"] = df_open["Total"].apply(format_currency)
-
-                # Selecionar apenas as colunas desejadas
-                df_open = df_open[["Client", "Total_display"]]
-
-                # Resetar o índice e remover
-                df_open = df_open.reset_index(drop=True)
-
-                # Estilização da tabela
-                styled_df_open = df_open.style.set_table_styles([
-                    {'selector': 'th', 'props': [('background-color', '#ff4c4c'), ('color', 'white'), ('padding', '8px')]},
-                    {'selector': 'td', 'props': [('padding', '8px'), ('text-align', 'right')]}
-                ])
-
-                st.write(styled_df_open)
+                # Tabela virtualizada: só as linhas visíveis são desenhadas no navegador
+                st.dataframe(
+                    df_open,
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={"Total": st.column_config.NumberColumn(format="R$ %.2f")}
+                )
 
                 st.markdown(f"**Total Geral (Open Orders):** {format_currency(total_open)}")
             else:
@@ -353,35 +621,21 @@ def home_page():
         # ======================= Stock vs. Orders Summary =======================
         with st.expander("Stock vs. Orders Summary"):
             try:
-                stock_vs_orders_query = """
-                    SELECT product, stock_quantity, orders_quantity, total_in_stock
-                    FROM public.vw_stock_vs_orders_summary
-                """
-                stock_vs_orders_data = run_query(stock_vs_orders_query)
+                stock_vs_orders_data = get_stock_vs_orders_summary()
                 if stock_vs_orders_data:
                     df_svo = pd.DataFrame(
                         stock_vs_orders_data,
-                        columns=["Product", "Stock_Quantity", "Orders_Quantity", "Total_in_Stock"]
+                        columns=["Product", "Stock_Quantity", "Orders_Quantity", "Total_in_Stock", "Total_Geral"]
+                    )
+                    st.dataframe(
+                        df_svo[["Product", "Total_in_Stock"]],
+                        use_container_width=True,
+                        hide_index=True,
+                        column_config={"Total_in_Stock": st.column_config.NumberColumn(format="%d")}
                     )
-                    df_svo.sort_values("Total_in_Stock", ascending=False, inplace=True)
-                    df_display = df_svo[["Product", "Total_in_Stock"]]
-                    
-                    # Formatar a coluna para exibição
-                    df_display["Total_in_Stock"] = df_display["Total_in_Stock"].apply(lambda x: f"{x:,}")
-
-                    # Resetar o índice e remover
-                    df_display = df_display.reset_index(drop=True)
-
-                    # Estilização da tabela
-                    styled_df_svo = df_display.style.set_table_styles([
-                        {'selector': 'th', 'props': [('background-color', '#ff4c4c'), ('color', 'white'), ('padding', '8px')]},
-                        {'selector': 'td', 'props': [('padding', '8px'), ('text-align', 'right')]}
-                    ])
-
-                    st.write(styled_df_svo)
 
-                    # Calcular o total utilizando a coluna numérica original
-                    total_val = df_svo["Total_in_Stock"].sum()
+                    # Total geral já calculado pelo banco (igual em todas as linhas)
+                    total_val = stock_vs_orders_data[0][4]
                     st.markdown(f"**Total Geral (Stock vs. Orders):** {total_val:,}")
 
                 else:
@@ -391,14 +645,7 @@ def home_page():
 
         # ======================= Amount Invoiced =======================
         with st.expander("Amount Invoiced"):
-            faturado_query = """
-                SELECT date("Data") as dt, SUM("total") as total_dia
-                FROM public.vw_pedido_produto
-                WHERE status IN ('Received - Debited','Received - Credit','Received - Pix','Received - Cash')
-                GROUP BY date("Data")
-                ORDER BY date("Data")
-            """
-            faturado_data = run_query(faturado_query)
+            faturado_data = get_invoiced_per_day()
             if faturado_data:
                 df_fat = pd.DataFrame(faturado_data, columns=["Data", "Total do Dia"])
 
@@ -408,22 +655,13 @@ def home_page():
                 # Calcular a soma
                 total_geral = df_fat["Total do Dia"].sum()
 
-                # Formatar a coluna para exibição
-                df_fat["Total do Dia"] = df_fat["Total do Dia"].apply(format_currency)
-
-                # Selecionar apenas as colunas desejadas
-                df_fat = df_fat[["Data", "Total do Dia"]]
-
-                # Resetar o índice e remover
-                df_fat = df_fat.reset_index(drop=True)
-
-                # Estilização da tabela
-                styled_df_fat = df_fat.style.set_table_styles([
-                    {'selector': 'th', 'props': [('background-color', '#ff4c4c'), ('color', 'white'), ('padding', '8px')]},
-                    {'selector': 'td', 'props': [('padding', '8px'), ('text-align', 'right')]}
-                ])
-
-                st.write(styled_df_fat)
+                # Mantém 'Total do Dia' como float; o formato R$ é aplicado na exibição
+                st.dataframe(
+                    df_fat[["Data", "Total do Dia"]],
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={"Total do Dia": st.column_config.NumberColumn(format="R$ %.2f")}
+                )
 
                 # Exibir o total geral formatado
                 st.markdown(f"**Total Geral (Amount Invoiced):** {format_currency(total_geral)}")
@@ -466,7 +704,7 @@ def orders_page():
                 success = run_query(query_insert, (customer_name, product, quantity, datetime.now()), commit=True)
                 if success:
                     st.toast("Pedido registrado com sucesso!")
-                    refresh_data()
+                    refresh_data(scope={"orders", "clients", "revenue"})
                 else:
                     st.error("Falha ao registrar pedido.")
             else:
@@ -479,16 +717,7 @@ def orders_page():
             df_recent_orders = pd.DataFrame(orders_data, columns=["Cliente", "Produto", "Quantidade", "Data", "Status"])
             df_recent_orders = df_recent_orders.head(5)
             # Aplicando CSS para reduzir o tamanho do texto
-            st.markdown(
-                """
-                <style>
-                .small-font {
-                    font-size:10px;
-                }
-                </style>
-                """,
-                unsafe_allow_html=True
-            )
+            st.markdown(SMALL_FONT_CSS, unsafe_allow_html=True)
             st.markdown('<div class="small-font">', unsafe_allow_html=True)
             st.write(df_recent_orders.reset_index(drop=True).style.set_table_styles([
                 {'selector': 'th', 'props': [('background-color', '#ff4c4c'), ('color', 'white'), ('padding', '4px')]},
@@ -511,15 +740,18 @@ def orders_page():
             # Só exibe form de edição se for admin
             if st.session_state.get("username") == "admin":
                 st.markdown("### Editar ou Deletar Pedido")
-                df_orders["unique_key"] = df_orders.apply(
-                    lambda row: f"{row['Cliente']}|{row['Produto']}|{row['Data'].strftime('%Y-%m-%d %H:%M:%S')}",
-                    axis=1
+                df_orders["unique_key"] = (
+                    df_orders["Cliente"].astype(str) + "|" +
+                    df_orders["Produto"].astype(str) + "|" +
+                    pd.to_datetime(df_orders["Data"]).dt.strftime("%Y-%m-%d %H:%M:%S")
                 )
+                # Índice pela chave: a seleção vira um lookup em vez de varrer o DataFrame
+                df_orders = df_orders.set_index("unique_key", drop=False)
                 unique_keys = df_orders["unique_key"].unique().tolist()
                 selected_key = st.selectbox("Selecione Pedido", [""] + unique_keys)
 
                 if selected_key:
-                    match = df_orders[df_orders["unique_key"] == selected_key]
+                    match = df_orders.loc[[selected_key]]
                     if len(match) > 1:
                         st.warning("Múltiplos registros com a mesma chave.")
                     else:
@@ -559,7 +791,7 @@ def orders_page():
                             success = run_query(q_del, (original_client, original_product, original_date), commit=True)
                             if success:
                                 st.toast("Pedido deletado com sucesso!")
-                                refresh_data()
+                                refresh_data(scope={"orders", "clients", "revenue"})
                             else:
                                 st.error("Falha ao deletar pedido.")
 
@@ -575,7 +807,7 @@ def orders_page():
                             ), commit=True)
                             if success:
                                 st.toast("Pedido atualizado com sucesso!")
-                                refresh_data()
+                                refresh_data(scope={"orders", "clients", "revenue"})
                             else:
                                 st.error("Falha ao atualizar pedido.")
         else:
@@ -616,7 +848,7 @@ def products_page():
                 success = run_query(q_ins, (supplier, product, quantity, unit_value, custo_unitario, total_value, creation_date), commit=True)
                 if success:
                     st.toast("Produto adicionado com sucesso!")
-                    refresh_data()
+                    refresh_data(scope={"products"})
                 else:
                     st.error("Falha ao adicionar produto.")
             else:
@@ -634,14 +866,17 @@ def products_page():
 
             if st.session_state.get("username") == "admin":
                 st.markdown("### Editar / Deletar Produto")
-                df_prod["unique_key"] = df_prod.apply(
-                    lambda row: f"{row['Supplier']}|{row['Product']}|{row['Creation Date'].strftime('%Y-%m-%d')}",
-                    axis=1
+                df_prod["unique_key"] = (
+                    df_prod["Supplier"].astype(str) + "|" +
+                    df_prod["Product"].astype(str) + "|" +
+                    pd.to_datetime(df_prod["Creation Date"]).dt.strftime("%Y-%m-%d")
                 )
+                # Índice pela chave: a seleção vira um lookup em vez de varrer o DataFrame
+                df_prod = df_prod.set_index("unique_key", drop=False)
                 unique_keys = df_prod["unique_key"].unique().tolist()
                 selected_key = st.selectbox("Selecione Produto:", [""] + unique_keys)
                 if selected_key:
-                    match = df_prod[df_prod["unique_key"] == selected_key]
+                    match = df_prod.loc[[selected_key]]
                     if len(match) > 1:
                         st.warning("Múltiplos produtos com a mesma chave.")
                     else:
@@ -697,7 +932,7 @@ def products_page():
                             ), commit=True)
                             if success:
                                 st.toast("Produto atualizado com sucesso!")
-                                refresh_data()
+                                refresh_data(scope={"products"})
                             else:
                                 st.error("Falha ao atualizar produto.")
 
@@ -712,7 +947,7 @@ def products_page():
                             ), commit=True)
                             if success:
                                 st.toast("Produto deletado com sucesso!")
-                                refresh_data()
+                                refresh_data(scope={"products"})
                             else:
                                 st.error("Falha ao deletar produto.")
         else:
@@ -726,8 +961,9 @@ def stock_page():
     # ======================= ABA: Nova Movimentação =======================
     with tabs[0]:
         st.subheader("Registrar nova movimentação de estoque")
-        product_data = run_query("SELECT product FROM public.tb_products ORDER BY product;")
-        product_list = [row[0] for row in product_data] if product_data else ["No products"]
+        # Produtos já carregados em load_all_data (supplier, product, ...): sem nova consulta
+        product_data = st.session_state.data.get("products", [])
+        product_list = sorted({row[1] for row in product_data}) if product_data else ["No products"]
 
         with st.form(key='stock_form'):
             col1, col2, col3, col4 = st.columns(4)
@@ -751,7 +987,7 @@ def stock_page():
                 success = run_query(q_ins, (product, quantity, transaction, current_datetime), commit=True)
                 if success:
                     st.toast("Movimentação de estoque registrada com sucesso!")
-                    refresh_data()
+                    refresh_data(scope={"stock"})
                 else:
                     st.error("Falha ao registrar movimentação de estoque.")
             else:
@@ -770,14 +1006,17 @@ def stock_page():
 
             if st.session_state.get("username") == "admin":
                 st.markdown("### Editar/Deletar Registro de Estoque")
-                df_stock["unique_key"] = df_stock.apply(
-                    lambda row: f"{row['Produto']}|{row['Transação']}|{row['Data']}",
-                    axis=1
+                df_stock["unique_key"] = (
+                    df_stock["Produto"].astype(str) + "|" +
+                    df_stock["Transação"].astype(str) + "|" +
+                    df_stock["Data"].astype(str)
                 )
+                # Índice pela chave: a seleção vira um lookup em vez de varrer o DataFrame
+                df_stock = df_stock.set_index("unique_key", drop=False)
                 unique_keys = df_stock["unique_key"].unique().tolist()
                 selected_key = st.selectbox("Selecione Registro", [""] + unique_keys)
                 if selected_key:
-                    match = df_stock[df_stock["unique_key"] == selected_key]
+                    match = df_stock.loc[[selected_key]]
                     if len(match) > 1:
                         st.warning("Múltiplos registros com mesma chave.")
                     else:
@@ -790,8 +1029,6 @@ def stock_page():
                         with st.form(key='edit_stock_form'):
                             col1, col2, col3, col4 = st.columns(4)
                             with col1:
-                                product_data = run_query("SELECT product FROM public.tb_products ORDER BY product;")
-                                product_list = [row[0] for row in product_data] if product_data else ["No products"]
                                 edit_prod = st.selectbox("Produto", product_list, index=product_list.index(original_product) if original_product in product_list else 0)
                             with col2:
                                 edit_qty = st.number_input("Quantidade", min_value=1, step=1, value=int(original_qty))
@@ -823,7 +1060,7 @@ def stock_page():
                             ), commit=True)
                             if success:
                                 st.toast("Estoque atualizado com sucesso!")
-                                refresh_data()
+                                refresh_data(scope={"stock"})
                             else:
                                 st.error("Falha ao atualizar estoque.")
 
@@ -835,7 +1072,7 @@ def stock_page():
                             success = run_query(q_del, (original_product, original_trans, original_date), commit=True)
                             if success:
                                 st.toast("Registro deletado com sucesso!")
-                                refresh_data()
+                                refresh_data(scope={"stock"})
                             else:
                                 st.error("Falha ao deletar registro.")
         else:
@@ -873,7 +1110,6 @@ def clients_page():
                     success = run_query(q_ins, (nome_completo, data_nasc, genero, telefone, email, endereco), commit=True)
                     if success:
                         st.toast("Cliente registrado com sucesso!")
-                        refresh_data()
                     else:
                         st.error("Falha ao registrar cliente.")
                 except Exception as e:
@@ -895,17 +1131,18 @@ def clients_page():
 
                 if st.session_state.get("username") == "admin":
                     st.markdown("### Editar / Deletar Cliente")
-                    client_display = [""] + [f"{row['Full Name']} ({row['Email']})" for _, row in df_clients.iterrows()]
-                    selected_display = st.selectbox("Selecione Cliente:", client_display)
-                    if selected_display:
-                        try:
-                            original_name, original_email = selected_display.split(" (")
-                            original_email = original_email.rstrip(")")
-                        except ValueError:
-                            st.error("Seleção inválida.")
-                            st.stop()
-
-                        sel_row = df_clients[df_clients["Email"] == original_email].iloc[0]
+                    client_display = (
+                        df_clients["Full Name"].astype(str) + " (" + df_clients["Email"].astype(str) + ")"
+                    ).tolist()
+                    # A selectbox devolve a posição da linha: sem reparsear o rótulo nem filtrar o DataFrame
+                    selected_pos = st.selectbox(
+                        "Selecione Cliente:",
+                        [None] + list(range(len(client_display))),
+                        format_func=lambda pos: "" if pos is None else client_display[pos]
+                    )
+                    if selected_pos is not None:
+                        sel_row = df_clients.iloc[selected_pos]
+                        original_email = sel_row["Email"]
                         with st.form(key='edit_client_form'):
                             edit_name = st.text_input("Nome Completo", value=sel_row["Full Name"])
                             col_upd, col_del = st.columns(2)
@@ -924,7 +1161,6 @@ def clients_page():
                                 success = run_query(q_upd, (edit_name, original_email), commit=True)
                                 if success:
                                     st.toast("Cliente atualizado com sucesso!")
-                                    refresh_data()
                                 else:
                                     st.error("Falha ao atualizar cliente.")
 
@@ -934,8 +1170,7 @@ def clients_page():
                                 success = run_query(q_del, (original_email,), commit=True)
                                 if success:
                                     st.toast("Cliente deletado com sucesso!")
-                                    refresh_data()
-                                    st.experimental_rerun()
+                                    rerun()
                                 else:
                                     st.error("Falha ao deletar cliente.")
                             except Exception as e:
@@ -957,12 +1192,20 @@ def process_payment(client, payment_status):
     """
     success = run_query(query, (payment_status, client), commit=True)
     if success:
+        get_open_clients.clear()
+        get_invoice.clear()
+        # O pagamento tira o cliente do total em aberto e entra no faturado do dia
+        get_open_orders_summary.clear()
+        get_invoiced_per_day.clear()
         st.toast(f"Pagamento via {payment_status.split('-')[-1].strip()} processado com sucesso!")
     else:
         st.error("Falha ao processar pagamento.")
 
 def generate_invoice_for_printer(df: pd.DataFrame):
-    """Gera uma representação textual da nota fiscal para impressão."""
+    """
+    Gera uma representação textual da nota fiscal para impressão.
+    `df` já vem agregado do banco por produto: Produto, Quantidade (soma, int), total (soma, float).
+    """
     company = "Boituva Beach Club"
     address = "Avenida do Trabalhador 1879"
     city = "Boituva - SP 18552-100"
@@ -982,17 +1225,15 @@ def generate_invoice_for_printer(df: pd.DataFrame):
     invoice.append("DESCRIÇÃO             QTD     TOTAL")
     invoice.append("--------------------------------------------------")
 
-    # Garante que df["total"] seja numérico
-    df["total"] = pd.to_numeric(df["total"], errors="coerce").fillna(0)
-    grouped_df = df.groupby('Produto').agg({'Quantidade': 'sum', 'total': 'sum'}).reset_index()
-    total_general = 0
-    for _, row in grouped_df.iterrows():
-        description = f"{row['Produto'][:20]:<20}"
-        quantity = f"{int(row['Quantidade']):>5}"
-        total_item = row['total']
-        total_general += total_item
-        total_formatted = format_currency(total_item)
-        invoice.append(f"{description} {quantity} {total_formatted}")
+    # Linhas de item montadas por coluna (descrição 20, quantidade 5, total em R$)
+    produto, qtd, totals = (df[c] for c in df.columns[:3])
+    total_general = totals.sum()
+    lines = (
+        produto.astype(str).str.slice(0, 20).str.ljust(20) + " " +
+        qtd.astype(str).str.rjust(5) + " " +
+        format_currency_series(totals)
+    )
+    invoice.extend(lines.tolist())
 
     invoice.append("--------------------------------------------------")
     invoice.append(f"{'TOTAL GERAL:':>30} {format_currency(total_general):>10}")
@@ -1008,23 +1249,19 @@ def generate_invoice_for_printer(df: pd.DataFrame):
 def cash_page():
     """Página para gerar e gerenciar notas fiscais."""
     st.title("Cash")
-    open_clients_query = 'SELECT DISTINCT "Cliente" FROM public.vw_pedido_produto WHERE status=%s'
-    open_clients = run_query(open_clients_query, ('em aberto',))
-    client_list = [row[0] for row in open_clients] if open_clients else []
+    client_list = get_open_clients()
     selected_client = st.selectbox("Selecione um Cliente", [""] + client_list)
 
     if selected_client:
-        invoice_query = """
-            SELECT "Produto", "Quantidade", "total"
-            FROM public.vw_pedido_produto
-            WHERE "Cliente"=%s AND status=%s
-        """
-        invoice_data = run_query(invoice_query, (selected_client, 'em aberto'))
+        # Agregação por produto feita no banco (em cache)
+        invoice_data = get_invoice(selected_client)
         if invoice_data:
-            df = pd.DataFrame(invoice_data, columns=["Produto", "Quantidade", "total"])
-
-            # Converte para numeric
-            df["total"] = pd.to_numeric(df["total"], errors="coerce").fillna(0)
+            # Tipos fixados uma vez aqui; generate_invoice_for_printer usa as colunas direto
+            df = (
+                pd.DataFrame.from_records(invoice_data, columns=["Produto", "Quantidade", "total"], coerce_float=True)
+                .fillna({"Quantidade": 0, "total": 0})
+                .astype({"Quantidade": "int64", "total": "float64"})
+            )
             total_sem_desconto = df["total"].sum()
 
             # Cupom fixo de exemplo
@@ -1134,7 +1371,8 @@ def events_calendar_page():
             success = run_query(q_insert, (nome_evento, descricao_evento, data_evento, inscricao_aberta), commit=True)
             if success:
                 st.toast("Evento cadastrado com sucesso!")
-                st.experimental_rerun()
+                get_month_events.clear()
+                rerun()
             else:
                 st.error("Falha ao cadastrar evento.")
         else:
@@ -1189,22 +1427,12 @@ def events_calendar_page():
     # ----------------------------------------------------------------------------
     st.subheader("Visualização do Calendário")
 
-    cal = calendar.HTMLCalendar(firstweekday=0)
-    html_calendario = cal.formatmonth(ano_selecionado, mes_selecionado)
-
-    # Destacar dias com eventos
-    for ev in df_filtrado.itertuples():
-        dia = ev.data_evento.day
-        # Ajustar a cor de fundo para azul e o texto para branco
-        highlight_str = (
-            f' style="background-color:#1b4f72; color:white; font-weight:bold;" '
-            f'title="{ev.nome}: {ev.descricao}"'
-        )
-        # Substituir as tags <td class="mon">dia</td>, <td class="tue">dia</td>, etc.
-        for day_class in ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]:
-            target = f'<td class="{day_class}">{dia}</td>'
-            replacement = f'<td class="{day_class}"{highlight_str}>{dia}</td>'
-            html_calendario = html_calendario.replace(target, replacement)
+    # Destacar dias com eventos: uma única passada de regex (render_month_calendar, em cache)
+    html_calendario = render_month_calendar(
+        ano_selecionado,
+        mes_selecionado,
+        tuple(df_filtrado[["nome", "descricao", "data_evento"]].itertuples(index=False, name=None))
+    )
 
     # Adicionar CSS para estilizar o calendário e reduzir seu tamanho
     st.markdown(
@@ -1327,7 +1555,8 @@ def events_calendar_page():
                         success = run_query(q_update, (new_nome, new_desc, new_data, new_insc, event_id), commit=True)
                         if success:
                             st.toast("Evento atualizado com sucesso!")
-                            st.experimental_rerun()
+                            get_month_events.clear()
+                            rerun()
                         else:
                             st.error("Falha ao atualizar evento.")
                     else:
@@ -1340,7 +1569,8 @@ def events_calendar_page():
                     success = run_query(q_delete, (event_id,), commit=True)
                     if success:
                         st.toast(f"Evento ID={event_id} excluído com sucesso!")
-                        st.experimental_rerun()
+                        get_month_events.clear()
+                        rerun()
                     else:
                         st.error("Falha ao excluir evento.")
     else:
@@ -1466,32 +1696,37 @@ def apply_custom_css():
         unsafe_allow_html=True
     )
 
+# Menu lateral: páginas, ícones Bootstrap e estilos fixos, montados uma vez no import
+MENU_PAGES = (
+    "Home", "Orders", "Products", "Stock", "Clients",
+    "Cash",
+    "Calendário de Eventos"
+)
+MENU_ICONS = (
+    "house", "file-text", "box", "list-task", "layers",
+    "receipt",
+    "calendar"
+)
+MENU_STYLES = {
+    "container": {"background-color": "#1b4f72"},  # Azul escuro
+    "icon": {"color": "white", "font-size": "18px"},
+    "nav-link": {
+        "font-size": "14px", "text-align": "left", "margin": "0px",
+        "color": "white", "--hover-color": "#184563"  # Hover azul mais escuro
+    },
+    "nav-link-selected": {"background-color": "#184563", "color": "white"},  # Seleção em azul mais escuro
+}
+
 def sidebar_navigation():
     """Configura a barra lateral de navegação."""
     with st.sidebar:
         selected = option_menu(
             "Bar Menu",
-            [
-                "Home", "Orders", "Products", "Stock", "Clients",
-                "Cash",
-                 "Calendário de Eventos"
-            ],
-            icons=[
-                "house", "file-text", "box", "list-task", "layers",
-                "receipt",
-                "gift", "calendar"
-            ],
+            list(MENU_PAGES),
+            icons=list(MENU_ICONS),
             menu_icon="cast",
             default_index=0,
-            styles={
-                "container": {"background-color": "#1b4f72"},  # Alterado para vermelho
-                "icon": {"color": "white", "font-size": "18px"},
-                "nav-link": {
-                    "font-size": "14px", "text-align": "left", "margin": "0px",
-                    "color": "white", "--hover-color": "#184563"  # Hover vermelho mais escuro
-                },
-                "nav-link-selected": {"background-color": "#184563", "color": "white"},  # Seleção mais escura
-            }
+            styles=MENU_STYLES
         )
         if 'login_time' in st.session_state:
             st.write(
@@ -1516,6 +1751,11 @@ def main():
         login_page()
         return
 
+    # Mensagem agendada antes de um rerun (ex.: login) é mostrada uma única vez aqui
+    flash = st.session_state.pop("_flash", None)
+    if flash:
+        getattr(st, flash[0])(flash[1])
+
     selected_page = sidebar_navigation()
 
     if 'current_page' not in st.session_state:
@@ -1548,18 +1788,28 @@ def main():
                     del st.session_state[key]
             st.session_state.logged_in = False
             st.toast("Desconectado com sucesso!")
-            st.experimental_rerun()
+            rerun()
 
 ###############################################################################
 #                            LOGIN PAGE
 ###############################################################################
+LOGO_URL = "https://via.placeholder.com/300x100?text=Boituva+Beach+Club"
+
+@st.cache_data(ttl=86400, show_spinner=False)
+def load_logo(url: str):
+    """
+    Baixa o logo uma vez por dia (por processo) em vez de a cada rerun da tela de login.
+    Em caso de falha retorna None, que também fica em cache.
+    """
+    try:
+        resp = get_http_session().get(url, timeout=5)
+        resp.raise_for_status()
+    except requests.RequestException:
+        return None
+    return resp.content  # st.image aceita os bytes do PNG, sem decodificar com PIL
+
 def login_page():
     """Página de login do aplicativo."""
-    from PIL import Image
-    import requests
-    from io import BytesIO
-    from datetime import datetime
-
     # ---------------------------------------------------------------------
     # 1) CSS Customizado para melhorar aparência
     # ---------------------------------------------------------------------
@@ -1623,18 +1873,9 @@ def login_page():
     # ---------------------------------------------------------------------
     # 2) Carregar logo
     # ---------------------------------------------------------------------
-    logo_url = "https://via.placeholder.com/300x100?text=Boituva+Beach+Club"  # URL direto para a imagem
-    logo = None
-    try:
-        resp = requests.get(logo_url, timeout=5)
-        if resp.status_code == 200:
-            logo = Image.open(BytesIO(resp.content))
-    except Exception:
-        pass
-
+    logo = load_logo(LOGO_URL)
     if logo:
         st.image(logo, use_column_width=True)
-    st.title("")
 
     # ---------------------------------------------------------------------
     # 3) Formulário de login
@@ -1653,41 +1894,59 @@ def login_page():
     # 4) Ação: Login
     # ---------------------------------------------------------------------
     if btn_login:
+        login_started = time.perf_counter()
         if not username_input or not password_input:
             st.error("Por favor, preencha todos os campos.")
         else:
             try:
-                # Credenciais de exemplo
-                creds = st.secrets["credentials"]
-                admin_user = creds["admin_username"]
-                admin_pass = creds["admin_password"]
-                caixa_user = creds["caixa_username"]
-                caixa_pass = creds["caixa_password"]
+                salt, admin_user, admin_hash, caixa_user, caixa_hash = get_login_credentials()
             except KeyError:
                 st.error("Credenciais não encontradas em st.secrets['credentials']. Verifique a configuração.")
                 st.stop()
 
+            # Sem chave (fora de uma sessão do Streamlit) não há limite por origem
+            ip = client_ip()
+            if ip and login_blocked(ip):
+                st.error("Muitas tentativas de login. Aguarde um minuto e tente novamente.")
+                st.stop()
+
+            input_user = username_input.encode("utf-8")
+            input_hash = hash_password(password_input, salt).encode("utf-8")
+
             # Verificação de login com tempo constante para evitar ataques de timing
-            import hmac
+            def verify_credentials(actual_user, actual_hash):
+                # Compara bytes (aceita não-ASCII) e usa & para não curto-circuitar
+                user_ok = constant_time_equals(input_user, actual_user)
+                pass_ok = constant_time_equals(input_hash, actual_hash)
+                return user_ok & pass_ok
+
+            # Avalia os dois perfis antes de decidir, para o tempo não depender de qual casou
+            is_admin = verify_credentials(admin_user, admin_hash)
+            is_caixa = verify_credentials(caixa_user, caixa_hash)
+
+            # Espera até o piso fixo antes de responder, mascarando a variação restante
+            time.sleep(max(0.0, LOGIN_MIN_SECONDS - (time.perf_counter() - login_started)))
 
-            def verify_credentials(input_user, input_pass, actual_user, actual_pass):
-                return hmac.compare_digest(input_user, actual_user) and hmac.compare_digest(input_pass, actual_pass)
+            if ip and (is_admin | is_caixa):
+                clear_login_failures(ip)
 
-            if verify_credentials(username_input, password_input, admin_user, admin_pass):
+            if is_admin:
                 st.session_state.logged_in = True
                 st.session_state.username = "admin"
                 st.session_state.login_time = datetime.now()
-                st.toast("Login bem-sucedido como ADMIN!")
-                st.experimental_rerun()
+                st.session_state["_flash"] = ("toast", "Login bem-sucedido como ADMIN!")
+                rerun()
 
-            elif verify_credentials(username_input, password_input, caixa_user, caixa_pass):
+            elif is_caixa:
                 st.session_state.logged_in = True
                 st.session_state.username = "caixa"
                 st.session_state.login_time = datetime.now()
-                st.toast("Login bem-sucedido como CAIXA!")
-                st.experimental_rerun()
+                st.session_state["_flash"] = ("toast", "Login bem-sucedido como CAIXA!")
+                rerun()
 
             else:
+                if ip:
+                    record_login_failure(ip)
                 st.error("Usuário ou senha incorretos.")
 
     # ---------------------------------------------------------------------
@@ -0,0 +1,22 @@
+-- Índices para os filtros mais frequentes do aplicativo.
+-- Rodar uma vez (psql -f migrations/001_indices.sql); CONCURRENTLY não bloqueia
+-- escritas, por isso cada comando fica fora de transação.
+-- Conferir com EXPLAIN ANALYZE que as consultas passam a usar Index Scan.
+
+-- process_payment: UPDATE tb_pedido ... WHERE "Cliente"=%s AND status='em aberto'.
+-- Parcial: a maioria dos pedidos já está paga, então o índice fica pequeno e quente.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tb_pedido_cliente_em_aberto
+    ON public.tb_pedido ("Cliente")
+    WHERE status = 'em aberto';
+
+-- Edição/exclusão de pedidos: WHERE "Cliente"=%s AND "Produto"=%s AND "Data"=%s,
+-- e os últimos pedidos (ORDER BY "Data" DESC LIMIT 5).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tb_pedido_data
+    ON public.tb_pedido ("Data" DESC);
+
+-- Calendário de eventos: WHERE data_evento >= %s AND data_evento < %s.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tb_eventos_data_evento
+    ON public.tb_eventos (data_evento);
+
+-- tb_estoque não precisa de índice composto ("Produto","Transação","Data"):
+-- edição e exclusão de estoque localizam a linha pelo ctid (TID Scan).
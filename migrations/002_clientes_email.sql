@@ -0,0 +1,13 @@
+-- Índice único em tb_clientes(email).
+-- Rodar uma vez (psql -f migrations/002_clientes_email.sql), como a 001: CONCURRENTLY
+-- não bloqueia escritas e precisa ficar fora de transação.
+-- Se falhar por e-mails duplicados, resolver os duplicados e remover o índice
+-- inválido (DROP INDEX CONCURRENTLY) antes de rodar de novo.
+
+-- Edição/exclusão de clientes: UPDATE/DELETE tb_clientes ... WHERE email=%s.
+-- O cadastro gera e-mails únicos (nome + timestamp), então o índice pode ser UNIQUE.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_tb_clientes_email
+    ON public.tb_clientes (email);
+
+-- tb_eventos(id) é a chave primária: já tem índice.
+-- tb_pedido("Cliente", status) já é coberto por idx_tb_pedido_cliente_em_aberto (001).